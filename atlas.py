@@ -0,0 +1,188 @@
+import json
+import os
+
+import pygame
+
+
+def _next_pow2(value):
+    res = 1
+    while res < value:
+        res *= 2
+    return res
+
+
+class MaxRectsBin():
+    """ MaxRects bin packer (best short side fit)
+        free space is kept as a list of maximal, possibly overlapping rects
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._free = [pygame.Rect(0, 0, width, height)]
+
+    def insert(self, width, height):
+        """ place a width x height rect, returns its Rect or None if full """
+        best = None
+        best_score = None
+        for free in self._free:
+            if free.w >= width and free.h >= height:
+                left_w = free.w - width
+                left_h = free.h - height
+                score = (min(left_w, left_h), max(left_w, left_h))
+                if best_score is None or score < best_score:
+                    best, best_score = free, score
+        if best is None:
+            return None
+        placed = pygame.Rect(best.x, best.y, width, height)
+        self._split(placed)
+        return placed
+
+    def _split(self, placed):
+        new_free = []
+        for free in self._free:
+            if not free.colliderect(placed):
+                new_free.append(free)
+                continue
+            # up to four maximal rects around the placed one
+            if placed.x > free.x:
+                new_free.append(pygame.Rect(free.x, free.y, placed.x - free.x, free.h))
+            if placed.right < free.right:
+                new_free.append(pygame.Rect(placed.right, free.y, free.right - placed.right, free.h))
+            if placed.y > free.y:
+                new_free.append(pygame.Rect(free.x, free.y, free.w, placed.y - free.y))
+            if placed.bottom < free.bottom:
+                new_free.append(pygame.Rect(free.x, placed.bottom, free.w, free.bottom - placed.bottom))
+        # drop rects contained in others
+        self._free = [free for i, free in enumerate(new_free)
+                      if not any(j != i and other.contains(free) and (other != free or j < i)
+                                 for j, other in enumerate(new_free))]
+
+
+class AtlasBuilder():
+    """ Packs loose sprites into power of two atlas pages
+
+        Sprites are trimmed to their bounding rect (alpha or colorkey), the
+        trim offset and original size are kept in the metadata so they can be
+        drawn exactly where the untrimmed sprite would be. save() writes the
+        pages as png files plus a json file that AtlasSpriteSheet loads.
+    """
+    def __init__(self, max_size=1024, padding=1, trim=True):
+        if max_size != _next_pow2(max_size):
+            raise ValueError('max_size has to be a power of two')
+        self._max_size = max_size
+        self._padding = padding
+        self._trim = trim
+        self._sprites = {} # name: (surf, trim_rect, orig_size)
+        self.pages = []
+        self.entries = {}
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def add(self, name, surf):
+        if name in self._sprites:
+            raise ValueError('sprite %r already added' % name)
+        rect = surf.get_bounding_rect() if self._trim else surf.get_rect()
+        if rect.w + self._padding > self._max_size or rect.h + self._padding > self._max_size:
+            raise ValueError('sprite %r does not fit into %d pixels with %d padding' % (name, self._max_size, self._padding))
+        self._sprites[name] = (surf, rect, surf.get_size())
+
+    def add_file(self, filename, name=None, colorkey=None):
+        """ add an image file, named after the file by default """
+        surf = pygame.image.load(filename)
+        if colorkey is not None:
+            surf.set_colorkey(colorkey)
+        if name is None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+        self.add(name, surf)
+
+    def add_sheet(self, sheet_ctrl, prefix="", skip_empty=True):
+        """ add every region of a SpriteSheetCtrl as prefix + index """
+        colorkey = sheet_ctrl.image.get_at((0, 0))
+        for idx in range(sheet_ctrl.cols * sheet_ctrl.rows):
+            region = sheet_ctrl.get_region_image(idx).copy()
+            region.set_colorkey(colorkey)
+            if skip_empty and not all(region.get_bounding_rect()[2:]):
+                continue
+            self.add("%s%d" % (prefix, idx), region)
+
+    def add_chunks(self, chunks, prefix="chunk"):
+        """ add cuteoh() fragments as prefix + index """
+        for idx, (s_rect, _, ss) in enumerate(chunks):
+            self.add("%s%d" % (prefix, idx), ss.subsurface(s_rect))
+
+    def _pack_page(self, order, width, height):
+        packer = MaxRectsBin(width, height)
+        placed = {}
+        rest = []
+        pad = self._padding
+        for name in order:
+            rect = self._sprites[name][1]
+            res = packer.insert(rect.w + pad, rect.h + pad)
+            if res is None:
+                rest.append(name)
+            else:
+                placed[name] = res
+        return placed, rest
+
+    def _page_sizes(self, area):
+        """ candidate power of two page sizes by growing area, up to max_size """
+        sizes = []
+        size = 1
+        while size <= self._max_size:
+            sizes += [(size, size)]
+            if size * 2 <= self._max_size:
+                sizes += [(size * 2, size)]
+            size *= 2
+        return [s for s in sizes if s[0] * s[1] >= area] or [sizes[-1]]
+
+    def pack(self):
+        """ pack all sprites into as few and small pages as possible """
+        pad = self._padding
+        # big sprites first, sorted by their longer side
+        rest = sorted(self._sprites, key=lambda name: (-max(self._sprites[name][1].size), name))
+        self.pages = []
+        self.entries = {}
+        while rest:
+            area = sum((self._sprites[n][1].w + pad) * (self._sprites[n][1].h + pad) for n in rest)
+            widest = max(self._sprites[n][1].w + pad for n in rest)
+            tallest = max(self._sprites[n][1].h + pad for n in rest)
+            placed = None
+            for width, height in self._page_sizes(area):
+                if width < widest or height < tallest:
+                    continue
+                placed, left = self._pack_page(rest, width, height)
+                page_size = (width, height)
+                if not left or width == height == self._max_size:
+                    break
+            if not placed:
+                raise ValueError('sprites do not fit into %d pixel pages' % self._max_size)
+
+            page = pygame.Surface(page_size, pygame.SRCALPHA)
+            page.fill((0, 0, 0, 0))
+            for name, rect in placed.items():
+                surf, trim, orig_size = self._sprites[name]
+                page.blit(surf, rect.topleft, trim)
+                self.entries[name] = dict(page=len(self.pages), rect=[rect.x, rect.y, trim.w, trim.h],
+                                          offset=[trim.x, trim.y], size=list(orig_size))
+            self.pages.append(page)
+            rest = left
+        return self.pages
+
+    def save(self, filename):
+        """ write pages next to filename (name_0.png, ..) and the json metadata """
+        if not self.pages and self._sprites:
+            self.pack()
+        base = os.path.splitext(filename)[0]
+        page_fns = []
+        for i, page in enumerate(self.pages):
+            page_fn = "%s_%d.png" % (base, i)
+            tmp_fn = "%s.tmp.png" % page_fn[:-4]
+            pygame.image.save(page, tmp_fn)
+            os.replace(tmp_fn, page_fn)
+            page_fns.append(os.path.basename(page_fn))
+        meta = dict(pages=page_fns, sprites=self.entries)
+        tmp_fn = filename + ".tmp"
+        with open(tmp_fn, "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp_fn, filename)
@@ -0,0 +1,157 @@
+import os
+import queue
+import threading
+
+
+class FrameEncoder():
+    """ Encodes captured frames to an animated GIF or APNG on a background thread
+
+        push() only copies the raw pixels (pygame.image.tostring) into a bounded
+        queue, so the UI thread never waits on disk or quantization. Frames that
+        don't fit in the buffer are dropped and counted in dropped_frames.
+        GIF frames are quantized against one palette computed from the first
+        palette_frames frames, so colors don't flicker between frames. A later
+        frame that the palette can't represent within max_color_error (a dialog
+        opening, new sprites) gets its own palette, which is kept for the
+        frames after it.
+        Pillow writes an animation from the list of all its frames, so encoded
+        frames are held in memory until finish(): about width*height bytes per
+        GIF frame and three times that per APNG frame. Frames past max_bytes
+        are not kept and counted in truncated_frames, which limits the length
+        of a capture.
+        Requires Pillow.
+    """
+    _STOP = object()
+
+    def __init__(self, filename, size, frame_delay=100, loop=0, buffer_frames=64, palette_frames=4, max_color_error=24,
+                 max_bytes=256*1024*1024):
+        from PIL import Image, ImageChops # optional dependency, fail early if it is missing
+        self._image_mod = Image
+        self._chops_mod = ImageChops
+        self._max_color_error = max_color_error
+        self._filename = filename
+        self._size = (int(size[0]), int(size[1]))
+        self._frame_delay = frame_delay
+        self._loop = loop
+        self._palette_frames = max(1, palette_frames)
+        self._is_gif = os.path.splitext(filename)[1].lower()==".gif"
+        self._queue = queue.Queue(maxsize=buffer_frames)
+        self._frames = []
+        self._frame_bytes = self._size[0] * self._size[1] * (1 if self._is_gif else 3)
+        self._max_frames = max(1, max_bytes // max(1, self._frame_bytes))
+        self._pending = [] # raw frames waiting for the palette to be known
+        self._palette = None
+        self.error = None # set by the worker thread, reported by the owner
+        self.frame_count = 0
+        self.palette_count = 0
+        self.dropped_frames = 0 # buffer full, counted on the UI thread
+        self.truncated_frames = 0 # over max_bytes, counted on the worker thread
+        self._thread = threading.Thread(target=self._run, name="FrameEncoder", daemon=True)
+        self._thread.start()
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+    def push(self, surf):
+        """ queue a frame (a surface of the encoder size), never blocks """
+        import pygame
+        if surf.get_size()!=self._size:
+            raise ValueError("frame size %s doesn't match encoder size %s" % (surf.get_size(), self._size))
+        if self.done:
+            self.dropped_frames += 1
+            return
+        try:
+            self._queue.put_nowait(pygame.image.tostring(surf, "RGB"))
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def finish(self, wait=False):
+        """ stop accepting frames and write the file once the queue is drained """
+        # a worker that failed no longer drains the queue, don't block on it
+        while not self.done:
+            try:
+                self._queue.put(self._STOP, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if wait:
+            self.wait()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _make_palette(self, images):
+        Image = self._image_mod
+        width, height = self._size
+        sheet = Image.new("RGB", (width, height * len(images)))
+        for i, image in enumerate(images):
+            sheet.paste(image, (0, i * height))
+        self.palette_count += 1
+        return sheet.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+
+    def _color_error(self, image, quantized):
+        """ largest per channel difference quantization made to image """
+        diff = self._chops_mod.difference(image, quantized.convert("RGB"))
+        return max(high for low, high in diff.getextrema())
+
+    def _add(self, image):
+        if len(self._frames) >= self._max_frames:
+            self.truncated_frames += 1
+            return
+        if not self._is_gif:
+            self._frames.append(image)
+            return
+        Image = self._image_mod
+        quantized = image.quantize(palette=self._palette, dither=Image.Dither.NONE)
+        if self._color_error(image, quantized) > self._max_color_error:
+            self._palette = self._make_palette([image])
+            quantized = image.quantize(palette=self._palette, dither=Image.Dither.NONE)
+        self._frames.append(quantized)
+
+    def _flush_pending(self):
+        if self._is_gif and self._pending:
+            self._palette = self._make_palette(self._pending)
+        for image in self._pending:
+            self._add(image)
+        self._pending = []
+
+    def _run(self):
+        Image = self._image_mod
+        try:
+            while True:
+                data = self._queue.get()
+                if data is self._STOP:
+                    break
+                image = Image.frombytes("RGB", self._size, data)
+                self.frame_count += 1
+                if self._is_gif and self._palette is None:
+                    self._pending.append(image)
+                    if len(self._pending) >= self._palette_frames:
+                        self._flush_pending()
+                else:
+                    self._add(image)
+            self._flush_pending()
+            self._save()
+        except Exception as e:
+            self.error = e
+
+    def _save(self):
+        if not self._frames:
+            return
+        first, *rest = self._frames
+        tmp_fn = self._filename + ".part"
+        try:
+            first.save(tmp_fn, format="GIF" if self._is_gif else "PNG", save_all=True, append_images=rest,
+                       duration=self._frame_delay, loop=self._loop)
+            os.replace(tmp_fn, self._filename)
+        except BaseException:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+        finally:
+            self._frames = []
@@ -0,0 +1,163 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import weakref
+
+
+def _close_at_exit(conf_ref):
+    conf = conf_ref()
+    if conf is not None:
+        conf.close()
+
+
+class Config():
+    """ Key/value settings persisted to a json file
+
+        Reads are served from an in-memory snapshot. Writes update the snapshot
+        and are flushed to disk by a background timer once no new writes came in
+        for flush_delay seconds (or on close()/interpreter exit).
+        Controls use it through the save_to_conf/load_from_conf decorators,
+        values are stored under "<control name>_<property>" keys.
+        Attribute access (conf.some_key) is supported for older code that used a
+        plain object as conf.
+    """
+    def __init__(self, filename=None, flush_delay=1.0, autoload=True):
+        self._filename = filename
+        self._flush_delay = flush_delay
+        self._values = {}
+        self._keys = {} # (name, attr) -> "name_attr"
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # serializes flushes, so an older snapshot never lands last
+        self._timer = None
+        self._deadline = 0
+        self._dirty = False
+        self._flush_count = 0
+        self._at_exit = None
+        if filename is not None:
+            if autoload and os.path.exists(filename):
+                self.load()
+            # weak, so the exit hook doesn't keep dropped configs alive
+            self._at_exit = functools.partial(_close_at_exit, weakref.ref(self))
+            atexit.register(self._at_exit)
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @property
+    def flush_count(self):
+        """ number of writes to disk so far """
+        return self._flush_count
+
+    def _key(self, name, attr):
+        key = self._keys.get((name, attr))
+        if key is None:
+            key = self._keys[(name, attr)] = "%s_%s" % (name, attr)
+        return key
+
+    def lookup(self, name, attr, default=None):
+        """ fast path used by load_from_conf """
+        return self._values.get(self._key(name, attr), default)
+
+    def store(self, name, attr, value):
+        """ fast path used by save_to_conf """
+        self.set(self._key(name, attr), value)
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        if isinstance(value, list):
+            value = tuple(value)
+        with self._lock:
+            if key in self._values and self._values[key]==value:
+                return
+            self._values[key] = value
+            self._dirty = True
+            self._schedule_flush()
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        if name.startswith("_") or isinstance(getattr(type(self), name, None), property):
+            super().__setattr__(name, value)
+        else:
+            self.set(name, value)
+
+    def _schedule_flush(self):
+        """ (re)arm the debounce timer, has to be called with the lock held """
+        if self._filename is None:
+            return
+        self._deadline = time.monotonic() + self._flush_delay
+        if self._timer is None:
+            self._start_timer(self._flush_delay)
+
+    def _start_timer(self, delay):
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            remaining = self._deadline - time.monotonic()
+            if remaining > 0:
+                self._start_timer(remaining)
+                return
+            self._timer = None
+        self.flush()
+
+    def load(self):
+        with open(self._filename, "r") as f:
+            values = json.load(f)
+        if not isinstance(values, dict):
+            raise ValueError("%s: config root should be an object" % self._filename)
+        with self._lock:
+            self._values = {k: tuple(v) if isinstance(v, list) else v for k, v in values.items()}
+            self._dirty = False
+
+    def flush(self):
+        """ write pending changes to disk (atomically) """
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty or self._filename is None:
+                    return
+                values = dict(self._values)
+                self._dirty = False
+            tmp_fn = "%s.tmp%d" % (self._filename, threading.get_ident())
+            try:
+                with open(tmp_fn, "w") as f:
+                    json.dump(values, f, indent=1, sort_keys=True)
+                os.replace(tmp_fn, self._filename)
+            except BaseException:
+                with self._lock:
+                    self._dirty = True # keep the changes pending for the next flush
+                if os.path.exists(tmp_fn):
+                    os.remove(tmp_fn)
+                raise
+            self._flush_count += 1
+
+    def close(self):
+        if self._at_exit is not None:
+            atexit.unregister(self._at_exit)
+            self._at_exit = None
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.flush()
@@ -1,7 +1,11 @@
 import os
 
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import json
 import math
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
 
 import numpy as np
 import pygame
@@ -50,6 +54,44 @@ def cuteoh(sprite_surf, chunk_size=6):
             subrects.append( (s_rect, (x, y), ss) )    
     return subrects
 
+def darken_surface(surf, amount):
+    """ copy of surf with amount subtracted from every color channel """
+    res = surf.copy()
+    res.fill((amount, amount, amount), special_flags=pygame.BLEND_RGB_SUB)
+    return res
+
+def scale_surface(surf, scale):
+    width, height = surf.get_size()
+    return pygame.transform.scale(surf, (int(width*scale), int(height*scale)))
+
+def colorkey_to_alpha(surf, colorkey=None):
+    """ per pixel alpha copy of surf where colorkey (surf's colorkey or the
+        color at (0, 0) by default) is fully transparent
+    """
+    if colorkey is None:
+        colorkey = surf.get_colorkey() or surf.get_at((0, 0))
+    res = pygame.Surface(surf.get_size(), pygame.SRCALPHA)
+    res.blit(surf, (0, 0))
+    alpha = pygame.surfarray.pixels_alpha(res)
+    rgb = pygame.surfarray.pixels3d(res)
+    alpha[(rgb == pygame.Color(colorkey)[:3]).all(axis=2)] = 0
+    del alpha, rgb
+    return res
+
+def slice_sheet(surf, sprite_size, skip_empty=False):
+    """ subsurfaces of a sprite_size grid in reading order (None for empty
+        cells if skip_empty)
+    """
+    sprite_w, sprite_h = sprite_size
+    res = []
+    for row in range(surf.get_height() // sprite_h):
+        for col in range(surf.get_width() // sprite_w):
+            sprite = surf.subsurface((col*sprite_w, row*sprite_h, sprite_w, sprite_h))
+            if skip_empty and not all(sprite.get_bounding_rect()[2:]):
+                sprite = None
+            res.append(sprite)
+    return res
+
 KERNEL_CACHE = {}
 
 # Ghost at #pygame-community
@@ -140,17 +182,24 @@ def make_matrix(roll, pitch, heading, x0, y0, z0):
     a = math.radians(roll)
     b = math.radians(pitch)
     g = math.radians(heading)
+    sa, ca = math.sin(a), math.cos(a)
+    sb, cb = math.sin(b), math.cos(b)
+    sg, cg = math.sin(g), math.cos(g)
 
-    T = np.array([[ math.cos(b)*math.cos(g), (math.sin(a)*math.sin(b)*math.cos(g) + 
-                math.cos(a)*math.sin(g)), (math.sin(a)*math.sin(g) - 
-                math.cos(a)*math.sin(b)*math.cos(g)), x0],
-                [-math.cos(b)*math.sin(g), (math.cos(a)*math.cos(g) - 
-                math.sin(a)*math.sin(b)*math.sin(g)), (math.sin(a)*math.cos(g) + 
-                math.cos(a)*math.sin(b)*math.sin(g)), y0],
-                    [        math.sin(b), -math.sin(a)*math.cos(b), math.cos(a)*math.cos(b), z0],
-                    [ 0, 0, 0, 1]])
+    T = np.array([[ cb*cg, sa*sb*cg + ca*sg, sa*sg - ca*sb*cg, x0],
+                  [-cb*sg, ca*cg - sa*sb*sg, sa*cg + ca*sb*sg, y0],
+                  [    sb,           -sa*cb,            ca*cb, z0],
+                  [     0,                0,                0,  1]])
     return T
 
+@lru_cache(maxsize=64)
+def cached_matrix(roll, pitch, heading, x0, y0, z0):
+    """ same as make_matrix but memoized, the returned matrix is read-only
+        so it can be shared between frames and callers
+    """
+    T = make_matrix(roll, pitch, heading, x0, y0, z0)
+    T.setflags(write=False)
+    return T
 
 def project25d(wx, wy, wz, win_width, win_height, fov=90.0, viewer_distance=0):
     """ Transforms this 3D point to 2D using a perspective projection. """    
@@ -176,6 +225,51 @@ def project25dAlt(wx, wy, wz, win_width, win_height, worldScale = 1.0):
     
     return int(sx), int(sy)    
 
+def project_points(points, win_width, win_height, matrix=None, fov=90.0, viewer_distance=0, near=0.1, cull_offscreen=False):
+    """ Batched version of project25d for (N,3) arrays of points.
+        matrix is an optional 4x4 transform (see make_matrix/cached_matrix) applied
+        before projecting. Points closer than near (after adding viewer_distance)
+        are culled, as are points outside of the window if cull_offscreen is set.
+        project25dAlt is the same projection with fov=worldScale and viewer_distance=0.
+        returns (coords, visible): an (M,2) int32 array of screen coordinates
+        and a boolean mask of length N telling which input points made it
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise ValueError("points should be an (N,3) array")
+    if matrix is not None:
+        matrix = np.asarray(matrix)
+        points = points @ matrix[:3, :3].T + matrix[:3, 3]
+
+    z = points[:, 2] + viewer_distance
+    visible = z > near
+    factor = fov / z[visible]
+
+    coords = np.empty((len(factor), 2), dtype=np.float64)
+    coords[:, 0] = points[visible, 0] * factor + win_width / 2
+    coords[:, 1] = points[visible, 1] * factor + win_height / 2
+    coords = coords.astype(np.int32)
+
+    if cull_offscreen:
+        on_screen = ((coords[:, 0] >= 0) & (coords[:, 0] < win_width) &
+                     (coords[:, 1] >= 0) & (coords[:, 1] < win_height))
+        coords = coords[on_screen]
+        visible[visible] = on_screen
+    return coords, visible
+
+def plot_points(surf, coords, colors):
+    """ plot projected points onto surf in one go via surfarray
+        coords should come from project_points(..., cull_offscreen=True)
+        colors is either a single color or an array of mapped colors (one per point)
+    """
+    if not len(coords):
+        return
+    if isinstance(colors, (tuple, list, pygame.Color)):
+        colors = surf.map_rgb(colors)
+    pixels = pygame.surfarray.pixels2d(surf)
+    pixels[coords[:, 0], coords[:, 1]] = colors
+    del pixels
+
 def clip(val, n, m):
     return min(m, max(n, val))
 
@@ -195,9 +289,13 @@ def rotate(vector_length, angle):
         # Angle = math.atan2(player.y-self.rect.y, player.x-self.rect.x)
         # Angle = (math.cos(Angle) * self.speed, math.sin(Angle) * self.speed)    
 
-def pivot_rotation(surf, pivot_x, pivot_y, angle):
+def pivot_rotation(surf, pivot_x, pivot_y, angle, cache=None):
     """ rotate pygame surface surf along specified pivot
+        pass a RotationCache as cache to reuse previously rotated surfaces
+        (the angle is quantized to the cache step then)
     """
+    if cache is not None:
+        angle = cache.quantize(angle)
     sprite_w, sprite_h = surf.get_size()
     centerx = 0
     centery = 0
@@ -213,29 +311,306 @@ def pivot_rotation(surf, pivot_x, pivot_y, angle):
     new_center_x += c_off_x
     new_center_y += c_off_y
     
-    muzzle = pygame.transform.rotate(surf, 180-angle)
+    if cache is not None:
+        muzzle = cache.rotate(surf, 180-angle, quantized=True)
+    else:
+        muzzle = pygame.transform.rotate(surf, 180-angle)
     m_size = muzzle.get_size()
     new_x = new_center_x - m_size[0]//2 - pivot_c_x
     new_y = new_center_y - m_size[1]//2 - pivot_c_y
 
     return new_x, new_y, muzzle    
 
-def darker(color, amount):
+class RotationCache():
+    """ memoizes rotated surfaces per source surface and angle
+        angles are quantized to step degrees, least recently used rotations
+        are evicted once max_bytes worth of rotated surfaces are held
+        smooth=True uses rotozoom instead of rotate (slower but filtered)
+    """
+    def __init__(self, step=1.0, max_bytes=16*1024*1024, smooth=False):
+        if step <= 0:
+            raise ValueError("step should be > 0")
+        self._step = step
+        self._max_bytes = max_bytes
+        self._smooth = smooth
+        self._entries = {} # id(surf) -> {angle: rotated surface}
+        self._lru = OrderedDict() # (id(surf), angle), least recently used first
+        self._sources = {} # id(surf) -> weakref to the source surface
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def step(self):
+        return self._step
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._lru)
+
+    def quantize(self, angle):
+        return (round(angle / self._step) * self._step) % 360
+
+    def _forget(self, surf_id, ref=None):
+        if ref is not None and self._sources.get(surf_id) is not ref:
+            return # stale callback, surf_id was dropped or reused since
+        self._sources.pop(surf_id, None)
+        for angle, rotated in self._entries.pop(surf_id, {}).items():
+            del self._lru[(surf_id, angle)]
+            self._bytes -= self._surf_bytes(rotated)
+
+    def _evict(self):
+        surf_id, angle = self._lru.popitem(last=False)[0]
+        rotations = self._entries[surf_id]
+        self._bytes -= self._surf_bytes(rotations.pop(angle))
+        if not rotations:
+            del self._entries[surf_id]
+            del self._sources[surf_id]
+
+    @staticmethod
+    def _surf_bytes(surf):
+        return surf.get_pitch() * surf.get_height()
+
+    def rotate(self, surf, angle, quantized=False):
+        """ cached version of pygame.transform.rotate(surf, angle)
+            quantized=True takes angle as is, for angles derived from a quantized one
+        """
+        angle = angle % 360 if quantized else self.quantize(angle)
+        surf_id = id(surf)
+        ref = self._sources.get(surf_id)
+        if ref is None or ref() is not surf:
+            if ref is not None:
+                self._forget(surf_id)
+            self._sources[surf_id] = weakref.ref(surf, lambda ref, surf_id=surf_id: self._forget(surf_id, ref))
+            self._entries[surf_id] = {}
+
+        rotations = self._entries[surf_id]
+        rotated = rotations.get(angle)
+        if rotated is not None:
+            self._lru.move_to_end((surf_id, angle))
+            self.hits += 1
+            return rotated
+
+        self.misses += 1
+        if self._smooth:
+            rotated = pygame.transform.rotozoom(surf, angle, 1.0)
+        else:
+            rotated = pygame.transform.rotate(surf, angle)
+        rotations[angle] = rotated
+        self._lru[(surf_id, angle)] = None
+        self._bytes += self._surf_bytes(rotated)
+        while self._bytes > self._max_bytes and len(self._lru) > 1:
+            self._evict()
+        return rotated
+
+    def pivot_rotation(self, surf, pivot_x, pivot_y, angle):
+        """ same as pivot_rotation() but served from this cache
+            returns new_x, new_y, rotated surface
+        """
+        return pivot_rotation(surf, pivot_x, pivot_y, angle, cache=self)
+
+    def precompute(self, surf):
+        """ fill the cache with every quantized rotation of surf """
+        steps = int(round(360 / self._step))
+        for i in range(steps):
+            self.rotate(surf, i * self._step)
+
+    def clear(self):
+        self._entries.clear()
+        self._lru.clear()
+        self._sources.clear()
+        self._bytes = 0
+
+class ChunkParticles():
+    """ animates sprite fragments produced by cuteoh() (explosions, shattering)
+        fragment state lives in numpy arrays (structure of arrays) so a physics
+        step is a handful of vectorized operations and drawing is a single blits() call
+        rotation_step (degrees) enables spinning fragments through a RotationCache
+        fragments cut from the same place of the same sheet share one subsurface
+        so their rotations are reused across emits
+    """
+    MAX_FRAGMENTS = 4096 # shared fragment subsurfaces kept between emits
+
+    def __init__(self, gravity=(0.0, 300.0), drag=0.5, speed=(60.0, 220.0), lifetime=(0.8, 1.6), spin=(-360.0, 360.0), rotation_step=None, seed=None):
+        self._gravity = np.array(gravity, dtype=np.float64)
+        self._drag = drag
+        self._speed = speed
+        self._lifetime = lifetime
+        self._spin = spin
+        self._rng = np.random.default_rng(seed)
+        self._rotation_cache = RotationCache(step=rotation_step) if rotation_step else None
+        self.clear()
+
+    def clear(self):
+        self._pos = np.empty((0, 2), dtype=np.float64) # fragment centers
+        self._vel = np.empty((0, 2), dtype=np.float64)
+        self._angle = np.empty(0, dtype=np.float64)
+        self._angular_vel = np.empty(0, dtype=np.float64)
+        self._life = np.empty(0, dtype=np.float64) # seconds left
+        self._half_size = np.empty((0, 2), dtype=np.float64)
+        self._images = np.empty(0, dtype=object)
+        self._fragments = OrderedDict() # (id(sheet), rect in sheet) -> subsurface, keeps the sheet alive
+
+    def _fragment(self, ss, s_rect):
+        # cuteoh() cuts fresh subsurfaces on every call, key on the surface they all share
+        sheet = ss.get_abs_parent()
+        off_x, off_y = ss.get_abs_offset()
+        rect = (off_x + s_rect[0], off_y + s_rect[1], s_rect[2], s_rect[3])
+        key = (id(sheet), rect)
+        img = self._fragments.get(key)
+        if img is None:
+            img = self._fragments[key] = sheet.subsurface(rect)
+            if len(self._fragments) > self.MAX_FRAGMENTS:
+                self._fragments.popitem(last=False)
+        else:
+            self._fragments.move_to_end(key)
+        return img
+
+    def __len__(self):
+        return len(self._images)
+
+    @property
+    def alive(self):
+        return len(self._images) > 0
+
+    def emit(self, chunks, x, y, velocity=(0.0, 0.0)):
+        """ add fragments of a cuteoh(sprite) result drawn at x, y
+            fragments fly away from the sprite center, velocity is added to all of them
+        """
+        n = len(chunks)
+        if not n:
+            return
+        images = np.empty(n, dtype=object)
+        pos = np.empty((n, 2), dtype=np.float64)
+        half_size = np.empty((n, 2), dtype=np.float64)
+        for i, (s_rect, (c_x, c_y), ss) in enumerate(chunks):
+            images[i] = self._fragment(ss, s_rect)
+            half_size[i] = s_rect[2] / 2, s_rect[3] / 2
+            pos[i] = x + c_x + s_rect[0] + half_size[i, 0], y + c_y + s_rect[1] + half_size[i, 1]
+
+        rng = self._rng
+        direction = pos - pos.mean(axis=0)
+        direction += rng.normal(0.0, 0.5, (n, 2))
+        norm = np.hypot(direction[:, 0], direction[:, 1])
+        norm[norm==0] = 1.0
+        direction /= norm[:, None]
+        speed = rng.uniform(*self._speed, n)
+
+        self._pos = np.concatenate((self._pos, pos))
+        self._vel = np.concatenate((self._vel, direction * speed[:, None] + velocity))
+        self._angle = np.concatenate((self._angle, np.zeros(n)))
+        self._angular_vel = np.concatenate((self._angular_vel, rng.uniform(*self._spin, n)))
+        self._life = np.concatenate((self._life, rng.uniform(*self._lifetime, n)))
+        self._half_size = np.concatenate((self._half_size, half_size))
+        self._images = np.concatenate((self._images, images))
+
+    def update(self, dt):
+        """ advance simulation by dt seconds and drop expired fragments """
+        if not len(self._images):
+            return
+        self._vel += self._gravity * dt
+        self._vel *= max(0.0, 1.0 - self._drag * dt)
+        self._pos += self._vel * dt
+        self._angle += self._angular_vel * dt
+        self._life -= dt
+
+        alive = self._life > 0
+        if not alive.all():
+            self._pos = self._pos[alive]
+            self._vel = self._vel[alive]
+            self._angle = self._angle[alive]
+            self._angular_vel = self._angular_vel[alive]
+            self._life = self._life[alive]
+            self._half_size = self._half_size[alive]
+            self._images = self._images[alive]
+
+    def draw(self, surf, xoff=0, yoff=0):
+        if not len(self._images):
+            return
+        if self._rotation_cache is None:
+            topleft = (self._pos - self._half_size + (xoff, yoff)).astype(np.int32).tolist()
+            surf.blits(zip(self._images, topleft), doreturn=False)
+            return
+
+        rotate = self._rotation_cache.rotate
+        images = [rotate(img, angle) for img, angle in zip(self._images, self._angle.tolist())]
+        centers = (self._pos + (xoff, yoff)).astype(np.int32).tolist()
+        surf.blits([(img, (c_x - img.get_width() // 2, c_y - img.get_height() // 2))
+                    for img, (c_x, c_y) in zip(images, centers)], doreturn=False)
+
+@lru_cache(maxsize=1024, typed=True)
+def _tint(color, amount, sign):
     if isinstance(amount, int):
-        return tuple(clip((c-amount), 0, 255) for c in color)
+        return tuple(clip(c + sign*amount, 0, 255) for c in color)
     elif isinstance(amount, float):
-        return tuple(clip(int(c - c*amount), 0, 255) for c in color)
+        return tuple(clip(int(c + sign*c*amount), 0, 255) for c in color)
     raise ValueError("amount should be int or float")
 
+def darker(color, amount):
+    """ memoized, colors are interned by value and tint amount """
+    return _tint(tuple(color), amount, -1)
+
 def brighter(color, amount):
-    if isinstance(amount, int):
-        return tuple(clip(c+amount,0,255) for c in color)
-    elif isinstance(amount, float):
-        return tuple(clip(int(c + c*amount),0,255) for c in color)
-    raise ValueError("amount should be int or float")
+    """ memoized, colors are interned by value and tint amount """
+    return _tint(tuple(color), amount, 1)
+
+class Palette():
+    """ shades derived from a single base color, resolved once
+        get these from Theme.palette() rather than creating them directly
+    """
+    def __init__(self, color, shade_tint=SHADE_TINT, light_tint=LIGHT_TINT, dark_tint=FOREGROUND_DARK_TINT):
+        self.color = tuple(color)
+        self.shade = darker(self.color, shade_tint)
+        self.light = brighter(self.color, light_tint)
+        self.dark = darker(self.color, dark_tint)
+        self._derived = {}
+
+    def darker(self, amount):
+        key = (-1, type(amount), amount)
+        res = self._derived.get(key)
+        if res is None:
+            res = self._derived[key] = darker(self.color, amount)
+        return res
+
+    def brighter(self, amount):
+        key = (1, type(amount), amount)
+        res = self._derived.get(key)
+        if res is None:
+            res = self._derived[key] = brighter(self.color, amount)
+        return res
 
-def pulse(range_, freq, shift=0.0):
-    secs = math.degrees(shift * _pi_2) + 90 - (((get_ticks()%1000)/2.77)*freq) % 360
+class Theme():
+    """ tints used to derive control shading, palettes are interned per base color
+        assign a Theme to BaseControl.theme to restyle a control
+    """
+    def __init__(self, shade_tint=SHADE_TINT, light_tint=LIGHT_TINT, dark_tint=FOREGROUND_DARK_TINT):
+        self.shade_tint = shade_tint
+        self.light_tint = light_tint
+        self.dark_tint = dark_tint
+        self._palettes = {}
+
+    def palette(self, color):
+        color = tuple(color)
+        res = self._palettes.get(color)
+        if res is None:
+            res = self._palettes[color] = Palette(color, self.shade_tint, self.light_tint, self.dark_tint)
+        return res
+
+DEFAULT_THEME = Theme()
+
+def get_palette(color, theme=None):
+    if theme is None:
+        theme = DEFAULT_THEME
+    return theme.palette(color)
+
+def pulse(range_, freq, shift=0.0, ticks=None):
+    """ pass ticks (e.g. App.get_ticks()) to follow the app clock """
+    if ticks is None:
+        ticks = get_ticks()
+    secs = math.degrees(shift * _pi_2) + 90 - (((ticks%1000)/2.77)*freq) % 360
     return (1 - math.sin( math.radians(secs) ) ) * range_/2
 
 def draw_line2(surf, coord1, coord2, xoff=0, yoff=0):
@@ -284,20 +659,897 @@ def draw_shaded_frame(surf, x, y, width, height, shade_color=None, light_color=N
         pygame.draw.line(surf, darker(light_color, 0.25), (x, y), (x, y))
         pygame.draw.line(surf, darker(light_color, 0.3), (right, bottom), (right, bottom))
 
-def draw_panel(surf, x, y, width, height, color, shade_color=None, light_color=None, mode=0, no_middle=False):
+def draw_panel(surf, x, y, width, height, color, shade_color=None, light_color=None, mode=0, no_middle=False, theme=None):
+    palette = get_palette(color, theme)
     if shade_color is None:
-        shade_color = darker(color, SHADE_TINT)
+        shade_color = palette.shade
     if light_color is None:
-        light_color = brighter(color, LIGHT_TINT)
+        light_color = palette.light
     if mode & 2:
-        color = darker(color, FOREGROUND_DARK_TINT)
+        color = palette.dark
     if not no_middle:
         pygame.draw.rect(surf, color, (x, y, width, height))    
     draw_shaded_frame(surf, x, y, width, height, shade_color, light_color, mode=mode)    
 
+class SurfaceCache():
+    """ LRU cache of pre-rendered surfaces (panels, frames, dialog chrome)
+        render(surf) is only called the first time a key is seen, after that
+        the stored surface is handed out until it gets evicted
+    """
+    def __init__(self, max_bytes=8*1024*1024):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, key, size, render, alpha=False):
+        surf = self._entries.get(key)
+        if surf is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return surf
+
+        self.misses += 1
+        size = (max(1, size[0]), max(1, size[1]))
+        display_ready = pygame.display.get_surface() is not None
+        if alpha:
+            surf = pygame.Surface(size, pygame.SRCALPHA)
+            if display_ready:
+                surf = surf.convert_alpha()
+            surf.fill((0, 0, 0, 0))
+        else:
+            surf = pygame.Surface(size)
+            if display_ready:
+                surf = surf.convert()
+        render(surf)
+        self._entries[key] = surf
+        self._bytes += surf.get_pitch() * surf.get_height()
+        while self._bytes > self._max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.get_pitch() * evicted.get_height()
+        return surf
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+PANEL_CACHE = SurfaceCache()
+
+class ScratchSurfacePool():
+    """ reusable temporary surfaces keyed by size and flags
+        a surface handed out by get() is only valid until the next get() of the
+        same size, so use it right away and don't keep references around
+        allocations counts new surfaces, watch it to catch per-frame churn
+    """
+    def __init__(self, max_entries=32):
+        self._max_entries = max_entries
+        self._surfaces = OrderedDict()
+        self.allocations = 0
+        self.requests = 0
+
+    def get(self, size, flags=0):
+        self.requests += 1
+        key = (int(size[0]), int(size[1]), flags)
+        surf = self._surfaces.get(key)
+        if surf is not None:
+            self._surfaces.move_to_end(key)
+            return surf
+
+        self.allocations += 1
+        surf = pygame.Surface(key[:2], flags)
+        if pygame.display.get_surface() is not None:
+            surf = surf.convert_alpha() if flags & pygame.SRCALPHA else surf.convert()
+        self._surfaces[key] = surf
+        if len(self._surfaces) > self._max_entries:
+            self._surfaces.popitem(last=False)
+        return surf
+
+    def reset_counters(self):
+        self.allocations = 0
+        self.requests = 0
+
+    def clear(self):
+        self._surfaces.clear()
+
+SCRATCH_SURFACES = ScratchSurfacePool()
+
+def _color_key(color):
+    return None if color is None else tuple(color)
+
+def draw_panel_cached(surf, x, y, width, height, color, shade_color=None, light_color=None, mode=0, no_middle=False, theme=None):
+    """ same as draw_panel but every distinct panel is rendered once into
+        PANEL_CACHE and blitted from there afterwards
+    """
+    key = ('panel', width, height, tuple(color), _color_key(shade_color), _color_key(light_color), mode, no_middle, theme)
+    render = lambda panel: draw_panel(panel, 0, 0, width, height, color, shade_color, light_color, mode, no_middle, theme)
+    surf.blit(PANEL_CACHE.get(key, (width+1, height+1), render, alpha=no_middle), (x, y))
+
+def draw_shaded_frame_cached(surf, x, y, width, height, shade_color=None, light_color=None, mode=0):
+    """ same as draw_shaded_frame but served from PANEL_CACHE """
+    key = ('frame', width, height, _color_key(shade_color), _color_key(light_color), mode)
+    render = lambda frame: draw_shaded_frame(frame, 0, 0, width, height, shade_color, light_color, mode)
+    surf.blit(PANEL_CACHE.get(key, (width+1, height+1), render, alpha=True), (x, y))
+
+class MarchingAnts():
+    """ dashed selection outline drawn from cached tileable dash strips
+        only the four edges are blitted, phase shifts the pattern so that
+        the ants march clockwise when it is increased over time
+    """
+    def __init__(self, color=(245, 233, 246), dash=3, gap=1, special_flags=pygame.BLEND_ADD):
+        self._color = color
+        self._dash = dash
+        self._period = dash + gap
+        self._special_flags = special_flags
+        self._length = 0
+        self._h_strip = None
+        self._v_strip = None
+
+    @property
+    def period(self):
+        return self._period
+
+    def _build_strips(self, length):
+        strip_len = 64
+        while strip_len < length + self._period:
+            strip_len *= 2
+        h_strip = pygame.Surface((strip_len, 1))
+        v_strip = pygame.Surface((1, strip_len))
+        if pygame.display.get_surface() is not None:
+            h_strip = h_strip.convert()
+            v_strip = v_strip.convert()
+        h_strip.fill((0, 0, 0))
+        v_strip.fill((0, 0, 0))
+        for i in range(0, strip_len, self._period):
+            h_strip.fill(self._color, (i, 0, self._dash, 1))
+            v_strip.fill(self._color, (0, i, 1, self._dash))
+        self._h_strip, self._v_strip, self._length = h_strip, v_strip, strip_len
+
+    def draw(self, surf, x, y, width, height, phase=0):
+        if width < 1 or height < 1:
+            return
+        if max(width, height) + self._period > self._length:
+            self._build_strips(max(width, height))
+        p = self._period
+        dash = self._dash
+        flags = self._special_flags
+        w = width - 1
+        h = height - 1
+        top_start = (-phase) % p
+        bottom_start = phase % p
+        left_start = phase % p
+        right_start = (-phase) % p
+
+        # edges without the corner pixels, these are added once below
+        if width > 2:
+            surf.blit(self._h_strip, (x+1, y), ((top_start+1) % p, 0, width-2, 1), flags)
+            if h > 0:
+                surf.blit(self._h_strip, (x+1, y+h), ((bottom_start+1) % p, 0, width-2, 1), flags)
+        if height > 2:
+            surf.blit(self._v_strip, (x, y+1), (0, (left_start+1) % p, 1, height-2), flags)
+            if w > 0:
+                surf.blit(self._v_strip, (x+w, y+1), (0, (right_start+1) % p, 1, height-2), flags)
+
+        corners = {}
+        for corner, start_1, i_1, start_2, i_2 in (((0, 0), top_start, 0, left_start, 0),
+                                                   ((w, 0), top_start, w, right_start, 0),
+                                                   ((0, h), bottom_start, 0, left_start, h),
+                                                   ((w, h), bottom_start, w, right_start, h)):
+            is_on = (start_1 + i_1) % p < dash or (start_2 + i_2) % p < dash
+            corners[corner] = corners.get(corner, False) or is_on
+        for (c_x, c_y), is_on in corners.items():
+            if is_on:
+                surf.fill(self._color, (x+c_x, y+c_y, 1, 1), special_flags=flags)
+
+class Brush():
+    """ paint brush as a boolean mask indexed [x, y] (surfarray order)
+        spacing is the distance between stamps along a stroke relative to the
+        brush size, density < 1 turns the brush into a spray
+    """
+    def __init__(self, mask, spacing=0.25, density=1.0, seed=None):
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim != 2 or not mask.any():
+            raise ValueError('brush mask has to be a non empty 2d array')
+        self._mask = mask
+        self._offsets = np.argwhere(mask) - (mask.shape[0] // 2, mask.shape[1] // 2)
+        self._spacing = max(1.0, spacing * max(mask.shape))
+        self._density = density
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def round(cls, diameter, **kwargs):
+        r = diameter / 2.0
+        c = np.arange(diameter) - r + 0.5
+        return cls(c[:, None]**2 + c[None, :]**2 <= r*r, **kwargs)
+
+    @classmethod
+    def square(cls, size, **kwargs):
+        return cls(np.ones((size, size), dtype=bool), **kwargs)
+
+    @classmethod
+    def from_surface(cls, surf, threshold=127, **kwargs):
+        """ brush from the opaque (alpha or colorkey) pixels of surf """
+        mask = pygame.mask.from_surface(surf, threshold)
+        w, h = mask.get_size()
+        return cls(np.array([[mask.get_at((x, y)) for y in range(h)] for x in range(w)], dtype=bool), **kwargs)
+
+    @property
+    def size(self):
+        return self._mask.shape
+
+    @property
+    def spacing(self):
+        return self._spacing
+
+    def stamp_centers(self, points):
+        """ stamp positions interpolated along points [(x, y), ..] """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) < 2:
+            return np.rint(points).astype(np.int64)
+        delta = np.diff(points, axis=0)
+        steps = np.maximum(1, np.ceil(np.hypot(delta[:, 0], delta[:, 1]) / self._spacing)).astype(np.int64)
+        segment = np.repeat(np.arange(len(delta)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps) + 1) / steps[segment]
+        centers = points[segment] + delta[segment] * t[:, None]
+        return np.rint(np.concatenate((points[:1], centers))).astype(np.int64)
+
+    def coverage(self, points, bounds):
+        """ pixels hit by a stroke along points clipped to bounds (w, h)
+            returns (rect, mask) or None, mask is a bool array of the rect size
+        """
+        centers = self.stamp_centers(points)
+        pixels = (centers[:, None, :] + self._offsets[None, :, :]).reshape(-1, 2)
+        if self._density < 1.0:
+            pixels = pixels[self._rng.random(len(pixels)) < self._density]
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 1] >= 0) & (pixels[:, 0] < bounds[0]) & (pixels[:, 1] < bounds[1])
+        pixels = pixels[inside]
+        if not len(pixels):
+            return None
+        x0, y0 = pixels.min(axis=0)
+        x1, y1 = pixels.max(axis=0) + 1
+        mask = np.zeros((x1 - x0, y1 - y0), dtype=bool)
+        mask[pixels[:, 0] - x0, pixels[:, 1] - y0] = True
+        return pygame.Rect(int(x0), int(y0), int(x1 - x0), int(y1 - y0)), mask
+
+def stamp_path(surf, points, brush, color):
+    """ paint a brush stroke along points [(x, y), ..] in one surfarray write
+        returns the dirty rect or None if nothing was painted
+    """
+    res = brush.coverage(points, surf.get_size())
+    if res is None:
+        return None
+    rect, mask = res
+    if surf.get_bytesize() == 3:
+        pixels = pygame.surfarray.pixels3d(surf)
+        value = pygame.Color(color)[:3]
+    else:
+        pixels = pygame.surfarray.pixels2d(surf)
+        # ints are taken as mapped colors (palette indices for indexed surfaces)
+        value = color if isinstance(color, int) else surf.map_rgb(color) & 0xffffffff # map_rgb is signed for opaque alpha
+    pixels[rect.x:rect.right, rect.y:rect.bottom][mask] = value
+    del pixels
+    return rect
+
+_LAYER_BLENDS = {
+    'normal': lambda dst, src: src,
+    'add': lambda dst, src: np.minimum(dst + src, 255.0),
+    'subtract': lambda dst, src: np.maximum(dst - src, 0.0),
+    'multiply': lambda dst, src: dst * src / 255.0,
+    'screen': lambda dst, src: 255.0 - (255.0 - dst) * (255.0 - src) / 255.0,
+    'lighten': np.maximum,
+    'darken': np.minimum,
+}
+LAYER_BLEND_MODES = tuple(_LAYER_BLENDS)
+
+class Layer():
+    """ one surface of a LayerStack, changing visible, opacity (0..255)
+        or blend (see LAYER_BLEND_MODES) invalidates the stack caches
+    """
+    def __init__(self, surface, name=None, visible=True, opacity=255, blend='normal'):
+        if blend not in _LAYER_BLENDS:
+            raise ValueError('unknown blend mode %r' % blend)
+        self._surface = surface
+        self.name = name
+        self._visible = visible
+        self._opacity = opacity
+        self._blend = blend
+        self._stack = None
+
+    def _changed(self):
+        if self._stack is not None:
+            self._stack.invalidate()
+
+    @property
+    def surface(self):
+        return self._surface
+
+    @surface.setter
+    def surface(self, surf):
+        self._surface = surf
+        self._changed()
+
+    @property
+    def visible(self):
+        return self._visible
+
+    @visible.setter
+    def visible(self, value):
+        self._visible = bool(value)
+        self._changed()
+
+    @property
+    def opacity(self):
+        return self._opacity
+
+    @opacity.setter
+    def opacity(self, value):
+        if not 0 <= value <= 255:
+            raise ValueError('opacity has to be within 0..255')
+        self._opacity = value
+        self._changed()
+
+    @property
+    def blend(self):
+        return self._blend
+
+    @blend.setter
+    def blend(self, value):
+        if value not in _LAYER_BLENDS:
+            raise ValueError('unknown blend mode %r' % value)
+        self._blend = value
+        self._changed()
+
+    @property
+    def is_plain(self):
+        """ composites as itself (opaque, normal, fully visible) """
+        return (self._visible and self._opacity==255 and self._blend=='normal' and
+                not self._surface.get_flags() & pygame.SRCALPHA and
+                not (is_indexed(self._surface) and self._surface.get_colorkey() is not None))
+
+    def rgba(self, rect):
+        """ float rgb and coverage (alpha * opacity, 0..1) arrays of rect """
+        sub = self._surface.subsurface(rect)
+        rgb = pygame.surfarray.array3d(sub).astype(np.float32)
+        if sub.get_flags() & pygame.SRCALPHA:
+            alpha = pygame.surfarray.array_alpha(sub).astype(np.float32) * (self._opacity / 65025.0)
+        elif is_indexed(sub) and sub.get_colorkey() is not None:
+            # transparent palette index
+            alpha = (pygame.surfarray.array2d(sub) != sub.map_rgb(sub.get_colorkey())) * np.float32(self._opacity / 255.0)
+        else:
+            alpha = np.full(rect[2:], self._opacity / 255.0, dtype=np.float32)
+        return rgb, alpha
+
+    def apply(self, dst, rect):
+        """ blend this layer over the float rgb array dst covering rect """
+        if not self._visible or not self._opacity:
+            return dst
+        rgb, alpha = self.rgba(rect)
+        return dst + alpha[..., None] * (_LAYER_BLENDS[self._blend](dst, rgb) - dst)
+
+class LayerStack():
+    """ layers of equal size composited bottom to top onto color
+        With a palette all layers are indexed 8-bit surfaces sharing it,
+        index 0 is transparent on the layers above the background
+        The layers below and above the active one are kept pre-composited
+        (below as rgb, above as premultiplied rgb + coverage when they all
+        blend normally) so painting on the active layer only re-composites
+        the changed rect against these two caches, see update()
+    """
+    def __init__(self, size, color, palette=None):
+        self._size = tuple(size)
+        self._color = color
+        self._palette = None if palette is None else _full_palette(palette)
+        if self._palette is not None:
+            base = pygame.Surface(self._size, 0, 8)
+            base.set_palette(self._palette)
+        else:
+            base = pygame.Surface(self._size)
+            if pygame.display.get_surface() is not None:
+                base = base.convert()
+        base.fill(color)
+        self._layers = []
+        self._active = 0
+        self._composite = None
+        self.generation = 0 # bumped whenever the caches are dropped
+        self.add_layer(Layer(base, 'background'))
+
+    def __len__(self):
+        return len(self._layers)
+
+    def __iter__(self):
+        return iter(self._layers)
+
+    def __getitem__(self, index):
+        return self._layers[index]
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def palette(self):
+        """ palette of indexed stacks, None otherwise """
+        return self._palette
+
+    def set_palette_color(self, index, color):
+        """ recolor every pixel of index on all layers at once """
+        if self._palette is None:
+            raise ValueError('layer stack is not indexed')
+        self._palette[index] = tuple(pygame.Color(color))[:3]
+        for layer in self._layers:
+            if is_indexed(layer.surface):
+                layer.surface.set_palette_at(index, color)
+        self.invalidate()
+
+    def new_layer(self, name=None, **kwargs):
+        """ a transparent layer of the stack size (not added) """
+        if self._palette is not None:
+            surf = pygame.Surface(self._size, 0, 8)
+            surf.set_palette(self._palette)
+            surf.set_colorkey(0)
+            surf.fill(0)
+        else:
+            surf = pygame.Surface(self._size, pygame.SRCALPHA)
+            surf.fill((0, 0, 0, 0))
+        return Layer(surf, name, **kwargs)
+
+    def add_layer(self, layer=None, index=None, **kwargs):
+        """ insert layer (a new transparent one if None) above index,
+            on top by default, and make it active
+        """
+        if layer is None:
+            layer = self.new_layer(**kwargs)
+        if layer.surface.get_size() != self._size:
+            raise ValueError('layer size has to be %r' % (self._size,))
+        index = len(self._layers) if index is None else index
+        self._layers.insert(index, layer)
+        layer._stack = self
+        self._active = index
+        self.invalidate()
+        return layer
+
+    def remove_layer(self, index):
+        if len(self._layers) == 1:
+            raise ValueError('can not remove the last layer')
+        layer = self._layers.pop(index)
+        layer._stack = None
+        self._active = min(self._active, len(self._layers) - 1)
+        self.invalidate()
+        return layer
+
+    def move_layer(self, index, new_index):
+        active = self._layers[self._active]
+        self._layers.insert(new_index, self._layers.pop(index))
+        self._active = self._layers.index(active)
+        self.invalidate()
+
+    @property
+    def active(self):
+        return self._active
+
+    @active.setter
+    def active(self, index):
+        if not -len(self._layers) <= index < len(self._layers):
+            raise IndexError('no layer %d' % index)
+        self._active = index % len(self._layers)
+        self.invalidate()
+
+    @property
+    def active_layer(self):
+        return self._layers[self._active]
+
+    def invalidate(self):
+        """ drop the cached composites, call it after painting on a
+            layer other than the active one
+        """
+        self._below = None
+        self._above = None
+        self.generation += 1
+
+    def _build_caches(self):
+        full = (0, 0) + self._size
+        below = np.empty(self._size + (3,), dtype=np.float32)
+        below[...] = pygame.Color(self._color)[:3]
+        for layer in self._layers[:self._active]:
+            below = layer.apply(below, full)
+        self._below = below
+
+        above = [layer for layer in self._layers[self._active+1:] if layer.visible and layer.opacity]
+        if all(layer.blend=='normal' for layer in above):
+            color = np.zeros(self._size + (3,), dtype=np.float32)
+            coverage = np.zeros(self._size, dtype=np.float32)
+            for layer in above:
+                rgb, alpha = layer.rgba(full)
+                color = rgb * alpha[..., None] + color * (1.0 - alpha[..., None])
+                coverage = alpha + coverage * (1.0 - alpha)
+            self._above = (color, coverage) if above else ()
+        else:
+            self._above = above # composited layer by layer
+
+    def composite(self):
+        """ the flattened image, the active layer itself if it's the only
+            visible one and plain
+        """
+        visible = [layer for layer in self._layers if layer.visible]
+        if len(visible) == 1 and visible[0].is_plain:
+            return visible[0].surface
+        if self._composite is None or self._composite.get_size() != self._size:
+            self._composite = pygame.Surface(self._size)
+            self.update()
+        return self._composite
+
+    def update(self, rect=None):
+        """ re-composite rect (everything by default) after painting the active layer """
+        visible = [layer for layer in self._layers if layer.visible]
+        if len(visible) == 1 and visible[0].is_plain:
+            return
+        if self._composite is None:
+            self._composite = pygame.Surface(self._size)
+        if self._below is None:
+            self._build_caches()
+        x, y, w, h = (0, 0) + self._size if rect is None else rect
+        out = self._below[x:x+w, y:y+h]
+        out = self.active_layer.apply(out, (x, y, w, h))
+        if isinstance(self._above, tuple):
+            if self._above:
+                color, coverage = self._above
+                out = out * (1.0 - coverage[x:x+w, y:y+h, None]) + color[x:x+w, y:y+h]
+        else:
+            for layer in self._above:
+                out = layer.apply(out, (x, y, w, h))
+        pixels = pygame.surfarray.pixels3d(self._composite)
+        pixels[x:x+w, y:y+h] = np.clip(np.rint(out), 0, 255).astype(np.uint8)
+        del pixels
+
+def opaque_mask(surf):
+    """ bool array [x, y] of sprite pixels: alpha > 0, not the colorkey or,
+        for opaque sheets, not the background color at (0, 0)
+    """
+    if surf.get_flags() & pygame.SRCALPHA:
+        return pygame.surfarray.pixels_alpha(surf) > 0
+    pixels = pygame.surfarray.array2d(surf) if surf.get_bytesize() == 3 else pygame.surfarray.pixels2d(surf)
+    colorkey = surf.get_colorkey()
+    background = surf.map_rgb(colorkey) if colorkey is not None else pixels[0, 0]
+    return pixels != (background & (1 << surf.get_bitsize()) - 1)
+
+def label_runs(mask):
+    """ 8-connected components of mask [x, y] labeled per horizontal run
+        returns (run_y, run_x0, run_x1, run_label), x1 is exclusive
+    """
+    rows = np.ascontiguousarray(mask.T)
+    width = rows.shape[1]
+    # run starts and ends alternate in every row of the change mask
+    changes = np.empty((rows.shape[0], width + 1), dtype=bool)
+    changes[:, 0] = rows[:, 0]
+    np.not_equal(rows[:, 1:], rows[:, :-1], out=changes[:, 1:width])
+    changes[:, width] = rows[:, -1]
+    flat = np.flatnonzero(changes)
+    run_y, run_x0 = np.divmod(flat[0::2], width + 1)
+    run_x1 = flat[1::2] % (width + 1)
+    n = len(run_y)
+    if not n:
+        return run_y, run_x0, run_x1, run_y
+    # runs of the next row that touch a run (diagonals included)
+    pitch = width + 2
+    start_key = run_y * pitch + run_x0
+    end_key = run_y * pitch + run_x1
+    next_row = (run_y + 1) * pitch
+    lo = np.searchsorted(end_key, next_row + run_x0 - 1, side='right')
+    hi = np.searchsorted(start_key, next_row + run_x1 + 1, side='left')
+    count = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(n), count)
+    b = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(lo, count)
+
+    # min label propagation with pointer jumping
+    labels = np.arange(n)
+    while True:
+        old = labels
+        labels = labels.copy()
+        np.minimum.at(labels, a, labels[b])
+        np.minimum.at(labels, b, labels[a])
+        labels = labels[labels]
+        if np.array_equal(labels, old):
+            break
+    return run_y, run_x0, run_x1, np.unique(labels, return_inverse=True)[1].ravel()
+
+def find_sprite_rects(surf, min_size=1, mask=None):
+    """ bounding rects of the connected sprites of surf (see opaque_mask)
+        in reading order
+    """
+    run_y, run_x0, run_x1, labels = label_runs(opaque_mask(surf) if mask is None else mask)
+    if not len(labels):
+        return []
+    count = labels.max() + 1
+    x0 = np.full(count, np.iinfo(np.int64).max)
+    y0 = x0.copy()
+    x1 = np.zeros(count, dtype=np.int64)
+    y1 = x1.copy()
+    np.minimum.at(x0, labels, run_x0)
+    np.minimum.at(y0, labels, run_y)
+    np.maximum.at(x1, labels, run_x1)
+    np.maximum.at(y1, labels, run_y + 1)
+    order = np.lexsort((x0, y0))
+    return [pygame.Rect(x, y, r - x, b - y) for x, y, r, b in zip(x0[order].tolist(), y0[order].tolist(), x1[order].tolist(), y1[order].tolist())
+            if r - x >= min_size and b - y >= min_size]
+
+def _profile_pitch(profile, min_pitch):
+    profile = profile - profile.mean()
+    n = len(profile)
+    if n < min_pitch * 2 or not profile.any():
+        return None
+    spectrum = np.fft.rfft(profile, 2 * n)
+    corr = np.fft.irfft(spectrum * np.conj(spectrum))[:n // 2 + 1]
+    corr /= corr[0]
+    lags = np.arange(max(min_pitch, 1), len(corr) - 1)
+    # local maxima only, small lags correlate just because sprites are smooth
+    lags = lags[(corr[lags] > corr[lags - 1]) & (corr[lags] >= corr[lags + 1])]
+    if not len(lags) or corr[lags].max() <= 0:
+        return None
+    values = corr[lags]
+    # the first strong peak is the pitch, later ones are its multiples
+    return int(lags[np.argmax(values >= values.max() * 0.8)])
+
+def detect_grid_pitch(surf, min_pitch=4, rects=None, mask=None):
+    """ (pitch_x, pitch_y) of a sprite grid from the occupancy profiles of
+        columns and rows, None if the sprites don't sit on a grid
+        rects (see find_sprite_rects) are used to verify the pitch
+    """
+    if mask is None:
+        mask = opaque_mask(surf)
+    pitch_x = _profile_pitch(np.count_nonzero(mask, axis=1).astype(np.float64), min_pitch)
+    pitch_y = _profile_pitch(np.count_nonzero(mask, axis=0).astype(np.float64), min_pitch)
+    if pitch_x is None or pitch_y is None:
+        return None
+    if rects is not None:
+        for rect in rects:
+            if rect.x // pitch_x != (rect.right - 1) // pitch_x or rect.y // pitch_y != (rect.bottom - 1) // pitch_y:
+                return None # a sprite crosses cell borders
+    return pitch_x, pitch_y
+
+def is_indexed(surf):
+    """ surf is 8-bit palettized """
+    return surf.get_bitsize() == 8
+
+def _full_palette(palette):
+    palette = [tuple(pygame.Color(color))[:3] for color in palette]
+    if len(palette) > 256:
+        raise ValueError('indexed images hold at most 256 colors')
+    return palette + [(0, 0, 0)] * (256 - len(palette))
+
+def to_indexed(surf, palette=None):
+    """ 8-bit palettized copy of surf, a quarter of the memory of 32-bit
+        palette defaults to the colors used by surf (at most 256), otherwise
+        every pixel gets the nearest palette entry. The colorkey is kept
+    """
+    if palette is None and is_indexed(surf):
+        return surf.copy()
+    rgb = pygame.surfarray.array3d(surf).astype(np.int32)
+    packed = ((rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]).ravel()
+    colors, inverse = np.unique(packed, return_inverse=True)
+    colors_rgb = np.stack(((colors >> 16) & 255, (colors >> 8) & 255, colors & 255), axis=1)
+    if palette is None:
+        if len(colors) > 256:
+            raise ValueError('surface has %d colors, indexed images hold 256' % len(colors))
+        palette = [tuple(c) for c in colors_rgb.tolist()]
+        indices = inverse
+    else:
+        palette = [tuple(pygame.Color(color))[:3] for color in palette]
+        dist = ((colors_rgb[:, None, :] - np.array(palette, dtype=np.int32)[None, :, :])**2).sum(axis=2)
+        indices = dist.argmin(axis=1)[inverse]
+
+    res = pygame.Surface(surf.get_size(), 0, 8)
+    res.set_palette(_full_palette(palette))
+    pixels = pygame.surfarray.pixels2d(res)
+    pixels[...] = indices.reshape(pixels.shape)
+    del pixels
+    if surf.get_colorkey() is not None:
+        res.set_colorkey(surf.get_colorkey())
+    return res
+
+def _flood_fill_indexed(surf, f_x, f_y, index):
+    """ span flood fill on palette indices, whole runs are filled with numpy """
+    pixels = pygame.surfarray.pixels2d(surf)
+    width, height = pixels.shape
+    target = pixels[f_x, f_y]
+    if target == index:
+        return
+    stack = [(f_x, f_y)]
+    while stack:
+        x, y = stack.pop()
+        line = pixels[:, y]
+        if line[x] != target:
+            continue
+        blocked = np.flatnonzero(line != target)
+        i = np.searchsorted(blocked, x)
+        left = blocked[i-1] + 1 if i > 0 else 0
+        right = blocked[i] if i < len(blocked) else width
+        line[left:right] = index
+        for n_y in (y - 1, y + 1):
+            if 0 <= n_y < height:
+                run = pixels[left:right, n_y] == target
+                starts = np.flatnonzero(run & np.concatenate(([True], ~run[:-1])))
+                stack.extend((left + int(s), n_y) for s in starts)
+    del pixels
+
+TILE_FLIP_X = 1
+TILE_FLIP_Y = 2
+TILE_TRANSPOSE = 4 # applied before the flips, TRANSPOSE|FLIP_X is a 90 degree turn
+
+def _tile_variant(tiles, transform):
+    """ transformed view of a (n, w, h) tile array """
+    if transform & TILE_TRANSPOSE:
+        tiles = tiles.transpose(0, 2, 1)
+    if transform & TILE_FLIP_X:
+        tiles = tiles[:, ::-1, :]
+    if transform & TILE_FLIP_Y:
+        tiles = tiles[:, :, ::-1]
+    return tiles
+
+def transform_tile(surf, transform):
+    """ surf transformed like _tile_variant (see TILE_FLIP_X etc.) """
+    if transform & TILE_TRANSPOSE:
+        surf = pygame.transform.flip(pygame.transform.rotate(surf, 90), False, True)
+    if transform & (TILE_FLIP_X | TILE_FLIP_Y):
+        surf = pygame.transform.flip(surf, transform & TILE_FLIP_X, transform & TILE_FLIP_Y)
+    return surf
+
+class TileSet():
+    """ unique tiles of a sheet plus a map of which tile (and how flipped or
+        turned) every cell shows, see TileSet.from_surface
+        tiles are subsurfaces of the source sheet until compact() is called
+    """
+    CHUNK_PIXELS = 1 << 20 # pixels hashed per step, bounds the temporary memory of from_surface
+    def __init__(self, tiles, index_map, transform_map, tile_size):
+        self.tiles = tiles
+        self.index_map = index_map # (rows, cols) tile index
+        self.transform_map = transform_map # (rows, cols) TILE_* bits
+        self.tile_size = tile_size
+        self._variants = {}
+
+    @classmethod
+    def from_surface(cls, surf, tile_size, variants=True):
+        """ split surf into tile_size cells and find duplicates by hashing
+            their pixels, variants also matches flipped (and for square
+            tiles turned) copies
+        """
+        tile_w, tile_h = tile_size
+        cols = surf.get_width() // tile_w
+        rows = surf.get_height() // tile_h
+        if surf.get_bytesize() == 3:
+            pixels = pygame.surfarray.array2d(surf)
+        else:
+            pixels = pygame.surfarray.pixels2d(surf)
+        pixels = pixels[:cols*tile_w, :rows*tile_h]
+        # (rows, cols, tile_w, tile_h) view, cells are copied a chunk at a time
+        grid = pixels.reshape(cols, tile_w, rows, tile_h).transpose(2, 0, 1, 3)
+        n = rows * cols
+        chunk = max(1, cls.CHUNK_PIXELS // (tile_w * tile_h))
+        cells = lambda sel: grid[sel // cols, sel % cols]
+
+        if not variants:
+            transforms = [0]
+        elif tile_w == tile_h:
+            transforms = list(range(8))
+        else:
+            transforms = [0, TILE_FLIP_X, TILE_FLIP_Y, TILE_FLIP_X | TILE_FLIP_Y]
+        weights = np.random.default_rng(0x5eed).integers(1, 2**63, tile_w * tile_h, dtype=np.uint64)
+        hashes = np.empty((n, len(transforms)), dtype=np.uint64)
+        for start in range(0, n, chunk):
+            block = cells(np.arange(start, min(n, start + chunk)))
+            for i, transform in enumerate(transforms):
+                hashes[start:start+len(block), i] = (_tile_variant(block, transform).reshape(len(block), -1) * weights).sum(axis=1)
+
+        # cells with the same smallest variant hash show the same tile
+        _, first, group = np.unique(hashes.min(axis=1), return_index=True, return_inverse=True)
+        group = group.ravel()
+        rep = first[group]
+        match = hashes[rep] == hashes[:, :1]
+        transform = np.array(transforms, dtype=np.uint8)[match.argmax(axis=1)]
+
+        # rule out hash collisions, such cells become tiles of their own
+        same = np.empty(n, dtype=bool)
+        for t in transforms:
+            sel_t = np.flatnonzero(transform == t)
+            for start in range(0, len(sel_t), chunk):
+                sel = sel_t[start:start+chunk]
+                same[sel] = (_tile_variant(cells(rep[sel]), t) == cells(sel)).all(axis=(1, 2))
+        del grid, pixels
+        rep[~same] = np.flatnonzero(~same)
+        transform[~same] = 0
+
+        uniques, index = np.unique(rep, return_inverse=True)
+        tiles = [surf.subsurface(((i % cols) * tile_w, (i // cols) * tile_h, tile_w, tile_h)) for i in uniques.tolist()]
+        return cls(tiles, index.reshape(rows, cols).astype(np.int32), transform.reshape(rows, cols), tuple(tile_size))
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @property
+    def cols(self):
+        return self.index_map.shape[1]
+
+    @property
+    def rows(self):
+        return self.index_map.shape[0]
+
+    @property
+    def ratio(self):
+        """ unique tiles per cell """
+        return len(self.tiles) / max(1, self.index_map.size)
+
+    def variant(self, index, transform=0):
+        """ tile index as shown in a cell with transform, cached """
+        if not transform:
+            return self.tiles[index]
+        key = (index, transform)
+        res = self._variants.get(key)
+        if res is None:
+            res = self._variants[key] = transform_tile(self.tiles[index], transform)
+        return res
+
+    def cell(self, col, row):
+        return self.variant(int(self.index_map[row, col]), int(self.transform_map[row, col]))
+
+    def cell_surfaces(self):
+        """ surfaces of all cells in reading order, equal cells share one surface """
+        return [self.variant(index, transform) for index, transform in
+                zip(self.index_map.ravel().tolist(), self.transform_map.ravel().tolist())]
+
+    def compact_sheet(self, cols=None):
+        """ sheet holding only the unique tiles, cols defaults to a square-ish layout """
+        tile_w, tile_h = self.tile_size
+        if cols is None:
+            cols = max(1, math.ceil(math.sqrt(len(self.tiles))))
+        rows = max(1, -(-len(self.tiles) // cols))
+        src = self.tiles[0] if self.tiles else None
+        if src is not None and src.get_flags() & pygame.SRCALPHA:
+            sheet = pygame.Surface((cols*tile_w, rows*tile_h), pygame.SRCALPHA, src)
+            sheet.fill((0, 0, 0, 0))
+        else:
+            sheet = pygame.Surface((cols*tile_w, rows*tile_h), 0, src) if src is not None else pygame.Surface((cols*tile_w, rows*tile_h))
+            if src is not None and is_indexed(src):
+                sheet.set_palette(src.get_palette())
+        sheet.blits([(tile, ((i % cols) * tile_w, (i // cols) * tile_h)) for i, tile in enumerate(self.tiles)], doreturn=False)
+        return sheet
+
+    def compact(self, cols=None):
+        """ move the tiles into their own compact sheet (freeing the source) """
+        sheet = self.compact_sheet(cols)
+        cols = sheet.get_width() // self.tile_size[0]
+        tile_w, tile_h = self.tile_size
+        self.tiles = [sheet.subsurface(((i % cols) * tile_w, (i // cols) * tile_h, tile_w, tile_h)) for i in range(len(self.tiles))]
+        self._variants = {}
+        return sheet
+
+    def save(self, image_fn, map_fn=None, cols=None):
+        """ write the compacted sheet and (optionally) the json tile map """
+        sheet = self.compact_sheet(cols)
+        pygame.image.save(sheet, image_fn)
+        if map_fn is not None:
+            with open(map_fn, "w") as f:
+                json.dump(dict(image=os.path.basename(image_fn), tile_size=list(self.tile_size),
+                               sheet_cols=sheet.get_width() // self.tile_size[0],
+                               tiles=self.index_map.tolist(), transforms=self.transform_map.tolist()), f)
+
+    def render(self, surf, x, y):
+        """ draw the whole map at x, y """
+        tile_w, tile_h = self.tile_size
+        cols = self.cols
+        surf.blits([(tile, (x + (i % cols) * tile_w, y + (i // cols) * tile_h)) for i, tile in enumerate(self.cell_surfaces())], doreturn=False)
+
 def flood_fill(surf, f_x, f_y, color):
     """ fill surface surf with specified color at f_x, f_y
+        indexed surfaces are filled by palette index (color may be one)
     """
+    if is_indexed(surf):
+        return _flood_fill_indexed(surf, f_x, f_y, color if isinstance(color, int) else surf.map_rgb(color))
     pixels = pygame.PixelArray(surf)
     width, height = surf.get_size()
 
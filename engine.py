@@ -1,3 +1,4 @@
+import inspect
 import os
 import types
 
@@ -9,6 +10,10 @@ import pygame
 
 from ui_controls import *
 from draw_utils import *
+from conf import Config
+from capture import FrameEncoder
+from replay import EventRecorder, EventPlayer
+from scheduler import Scheduler
 
 
 class App():
@@ -16,8 +21,10 @@ class App():
     """
     (MODE_PLAY, MODE_EDIT) = range(1, 3)    
     DOUBLECLICK_DELAY = 250 # ms
+    ANIM_TICK = 25 # ms per anim_timer step
 
-    def __init__(self, title=None, window_res=(640, 480), fps=60, dpi_aware=False, resizeable=False, vsync=True):
+    def __init__(self, title=None, window_res=(640, 480), fps=60, dpi_aware=False, resizeable=False, vsync=True, conf=None,
+                 update_rate=60, max_update_steps=5, coalesce_motion=True, headless=False):
         self._window_res = window_res
         self._title = title
         self._fps = fps
@@ -25,13 +32,25 @@ class App():
         self._bgcolor = COLOR_BACKGROUND
         self._mode = self.MODE_PLAY # not currently used
         self._resizeable = resizeable
-        self._vsync = vsync
+        self._vsync = vsync and not headless
+        self._headless = headless # render offscreen on SDL's dummy driver, see step()
+        self._headless_ticks = 0.0 # virtual clock of headless frames
+        self._initialized = False
+        self._conf = Config(conf) if isinstance(conf, str) else conf # Config, file name or None
+        self._coalesce_motion = coalesce_motion # merge mouse motion events within a frame
 
         self._is_running = True        
         self._hide_gui = False
         self._clear_screen = True
 
         self._on_draw_cb = None
+        self._on_draw_alpha = False # on_draw callback takes the interpolation alpha
+        self._on_update_cb = None
+        self._update_rate = update_rate # fixed on_update steps per second
+        self._max_update_steps = max_update_steps # catch-up limit per rendered frame
+        self._update_accumulator = 0.0
+        self._last_update_ticks = None
+        self.interpolation_alpha = 0.0
         self._on_post_draw_cb = None
         self._on_event_cb = None
         self._on_pre_draw_cb = None
@@ -42,11 +61,22 @@ class App():
         self._next_user_event = pygame.USEREVENT + 1
         self._events = {} # holds even states
         self._idle_ticks = 0 # used by some controls
-        self._anim_timer = 0 # used to animate sprites
+        self._anim_start = None # ticks anim_timer counts from
+        self._live_ticks = self._get_headless_ticks if headless else pygame.time.get_ticks
+        self._tick_source = self._live_ticks # recorded clock while replaying
+        self._ticks_offset = 0 # keeps get_ticks monotonic when the source changes
+        self._scheduler = Scheduler(self.get_ticks)
         self._last_mouse_click_pos = (0, 0)
         self._last_mouse_click_ticks = 0
         self._last_mouse_click_button = pygame.BUTTON_LEFT
         self._scaled_fullscreen = False
+        self._frame_encoder = None
+        self._finishing_encoders = [] # encoders still writing their file
+        self._capture_pending = False
+        self._frame_no = 0
+        self._recorder = None
+        self._player = None
+        self._quit_after_replay = True
 
         self._pushed_btn = None
         self._shadow_offset = 6
@@ -63,6 +93,8 @@ class App():
         """
         if not name.startswith("_") and isinstance(value, (BaseControl, Layout)):
             value._name = name
+            if isinstance(value, BaseControl) and value._conf is None:
+                value._conf = self._conf
             if value.layout is None and not value.layout is self._controls:
                 self._controls.add( value )
             value._app = self    
@@ -102,10 +134,30 @@ class App():
     on_gui_draw = property(fset=on_gui_draw)
 
     def on_draw(self, f_cb):
-        """ set on draw callback """
+        """ set on draw callback
+            f(app) or f(app, alpha) where alpha is the interpolation factor
+            between the last two on_update steps
+        """
+        params = list(inspect.signature(f_cb).parameters.values())
+        self._on_draw_alpha = len(params) > 1 or any(p.kind==p.VAR_POSITIONAL for p in params)
         self._on_draw_cb = types.MethodType(f_cb, self)
     on_draw = property(fset=on_draw) #write only
 
+    def on_update(self, f_cb):
+        """ set fixed timestep update callback f(app, dt), dt in seconds
+            runs update_rate times per second of game time no matter how
+            long rendering takes (up to max_update_steps per frame)
+        """
+        self._on_update_cb = types.MethodType(f_cb, self)
+    on_update = property(fset=on_update)
+
+    def set_update_rate(self, update_rate, max_update_steps=None):
+        if update_rate <= 0:
+            raise ValueError('update_rate has to be > 0')
+        self._update_rate = update_rate
+        if max_update_steps is not None:
+            self._max_update_steps = max_update_steps
+
     def on_quit(self, f_cb):
         """ set on quit callback
             Note: return False to postpone quitting
@@ -113,32 +165,69 @@ class App():
         self._on_quit_cb = types.MethodType(f_cb, self)
     on_quit = property(fset=on_quit)
 
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def call_later(self, millis, callback, *args):
+        """ call callback(*args) once after millis, returns a ScheduledCall
+            that can be paused, resumed or cancelled through app.scheduler
+        """
+        return self._scheduler.call_later(millis, callback, *args)
+
+    def call_every(self, millis, callback, *args):
+        """ call callback(*args) every millis until cancelled """
+        return self._scheduler.call_every(millis, callback, *args)
+
+    def cancel_call(self, call):
+        self._scheduler.cancel(call)
+
     def new_event(self, millis=0, once=0):
+        """ allocate a user event id, if millis > 0 the event is posted
+            every millis (or just once) by the scheduler
+        """
         event_id = self._next_user_event
+        if event_id >= pygame.NUMEVENTS:
+            raise ValueError('out of user event ids, use call_later/call_every instead')
         self._next_user_event += 1
-        event = dict(event_id=event_id, millis=millis, once=once)
+        event = dict(event_id=event_id, millis=millis, once=once, call=None)
         self._events[event_id] = event
         if millis > 0:
-            pygame.time.set_timer(event_id, millis, once)            
+            self._start_event_timer(event)
         return event_id
 
+    def _start_event_timer(self, event):
+        post = pygame.event.post
+        user_event = pygame.event.Event(event['event_id'])
+        if event['once']:
+            event['call'] = self._scheduler.call_later(event['millis'], post, user_event)
+        else:
+            event['call'] = self._scheduler.call_every(event['millis'], post, user_event)
+
     def resume_event(self, event_id, millis=None, once=None):
         if not event_id in self._events:
             raise ValueError('only user events can be disabled')
         event = self._events[event_id]
         if millis is not None and millis<=0:
             raise ValueError('millis have to be > 0')
-        event['millis']=millis
+        if millis is not None:
+            event['millis'] = millis
+        if not event['millis']:
+            raise ValueError('event has no timer interval')
         if once is not None:
             event['once'] = once
-        pygame.time.set_timer(event_id, event['millis'], event['once'])
+        if event['call'] is not None:
+            self._scheduler.cancel(event['call'])
+        self._start_event_timer(event)
 
     def pause_event(self, event_id):
         """ pause user event timer from firing """
         if not event_id in self._events:
             raise ValueError('only user events can be paused')
         event = self._events[event_id]
-        pygame.time.set_timer(event_id, 0)
+        if event['call'] is not None:
+            self._scheduler.cancel(event['call'])
+            event['call'] = None
 
 
     def toggle_scaled_fullscreen(self):    
@@ -149,31 +238,53 @@ class App():
 
     @property
     def anim_timer(self):
-        return self._anim_timer
+        """ ANIM_TICK steps since the app started, used to animate sprites """
+        if self._anim_start is None:
+            return 0
+        return max(0, self.get_ticks() - self._anim_start) // self.ANIM_TICK
         
 
     @property
     def controls(self):
         return self._controls
 
+    @property
+    def conf(self):
+        return self._conf
+
+    @property
+    def headless(self):
+        return self._headless
+
     def _go_scaled_fullscreen(self):
+        if self._headless:
+            return
         #fullscreen_res = pygame.display.get_desktop_sizes()[0]
         self._screen = pygame.display.set_mode(self._window_res, self._flags | pygame.SCALED | pygame.FULLSCREEN, vsync=self._vsync)
         self._scaled_fullscreen = True
 
     def _exit_scaled_fullscreen(self):
+        if self._headless:
+            return
         self._screen = pygame.display.set_mode(self._window_res, self._flags, vsync=self._vsync)
         self._scaled_fullscreen = False
 
     def _init_pygame(self):
-        if self._dpi_aware:
+        if self._dpi_aware and not self._headless:
             self._set_dpi_aware()
+        if self._headless and os.environ.get('SDL_VIDEODRIVER') not in ('dummy', 'offscreen'):
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
         pygame.init()
         self._flags = pygame.DOUBLEBUF
         if self._resizeable:
             self._flags = self._flags | pygame.RESIZABLE
         
-        self._screen = pygame.display.set_mode(self._window_res, self._flags, vsync=self._vsync)        
+        if self._headless:
+            # the display only provides a pixel format for convert(), frames go offscreen
+            display = pygame.display.set_mode((1, 1))
+            self._screen = pygame.Surface(self._window_res, 0, display)
+        else:
+            self._screen = pygame.display.set_mode(self._window_res, self._flags, vsync=self._vsync)        
         if self._title is not None:
             pygame.display.set_caption(self._title)
 
@@ -181,14 +292,15 @@ class App():
         #print('pygame.display.get_driver()', pygame.display.get_driver())
 
         self._clock = pygame.time.Clock()
-        self.get_ticks = pygame.time.get_ticks  
 
         self._EVENT_CAPTURE_FRAME = self.new_event()
-        self.EVENT_ANIM_HEARTBEAT = self.new_event(25)
+        self.EVENT_ANIM_HEARTBEAT = self.new_event() # kept for compatibility, anim_timer is derived from ticks
+        self._anim_start = self.get_ticks()
         self.EVENT_DOUBLECLICK = self.new_event()
 
         self._shadow_surface = pygame.Surface((self.screen_width, self.screen_height)).convert()
         self.metrics_fps = 0
+        self.metrics_work_fps = 0
 
     def _set_selected_control(self, control):
         if self._selected_control is not None and self._selected_control!=control:
@@ -197,19 +309,82 @@ class App():
         if control is not None:            
             control.selected = True
 
+    @property
+    def frame_no(self):
+        return self._frame_no
+
+    def record_events(self, filename):
+        """ record all events (with frame numbers and ticks) to filename
+            until the app quits, see replay_events
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+        self._recorder = EventRecorder(filename)
+
+    def replay_events(self, filename, quit_when_done=True):
+        """ feed events recorded by record_events instead of the real input
+            App.get_ticks follows the recorded clock while replaying
+        """
+        self._player = EventPlayer(filename)
+        self._quit_after_replay = quit_when_done
+        self._set_tick_source(self._player.get_ticks, offset=0)
+
+    def _next_events(self):
+        events = pygame.event.get()
+        if self._player is not None:
+            if self._player.finished:
+                self._player = None
+                self._set_tick_source(self._live_ticks)
+                if self._quit_after_replay:
+                    self.quit()
+            else:
+                # live input is ignored while replaying, except for closing the window
+                events = self._player.next_frame() + [event for event in events if event.type==pygame.QUIT]
+        if self._recorder is not None:
+            self._recorder.record_frame(self._frame_no, self.get_ticks(), events)
+        self._frame_no += 1
+        return events
+
+    def _coalesce_events(self, events):
+        """ merge runs of MOUSEMOTION events into one with the latest pos and
+            summed rel, every motion event gets a path attribute with all the
+            (x, y, x_rel, y_rel) positions it stands for
+        """
+        res = []
+        run = []
+        for event in events + [None]:
+            if event is not None and event.type==pygame.MOUSEMOTION:
+                if not run or (self._coalesce_motion and run[-1].buttons==event.buttons):
+                    run.append(event)
+                    continue
+            if run:
+                path = [(*e.pos, *e.rel) for e in run]
+                if len(run) == 1:
+                    merged = run[0]
+                    merged.path = path
+                else:
+                    attrs = dict(run[-1].__dict__)
+                    attrs['rel'] = (sum(p[2] for p in path), sum(p[3] for p in path))
+                    attrs['path'] = path
+                    merged = pygame.event.Event(pygame.MOUSEMOTION, attrs)
+                res.append(merged)
+                run = []
+            if event is not None:
+                if event.type==pygame.MOUSEMOTION:
+                    run.append(event)
+                else:
+                    res.append(event)
+        return res
+
     def _dispatch_events(self):
         """ default engine's event dispatched that would also call
             a cutsom event handler cb here
         """
-        for event in pygame.event.get():            
+        for event in self._coalesce_events(self._next_events()):            
             if event.type == pygame.QUIT:
                 if self._on_quit_cb is None or self._on_quit_cb():     
                     self.quit()
                 
-            if event.type==self.EVENT_ANIM_HEARTBEAT:
-                self._anim_timer += 1
-                continue
-
             if event.type in self._unsettling_events:
                 self._idle_ticks = 0
 
@@ -266,7 +441,10 @@ class App():
 
             elif event.type==pygame.MOUSEMOTION:                 
                 for ctrl, button, drag_mode in self._draged_controls:
-                    ctrl.drag_move(drag_mode, *event.pos, *event.rel, self, button)
+                    if ctrl._motion_path:
+                        ctrl.drag_path(drag_mode, event.path, self, button)
+                    else:
+                        ctrl.drag_move(drag_mode, *event.pos, *event.rel, self, button)
 
             elif event.type==pygame.KEYDOWN:
                 if event.key==pygame.K_ESCAPE:
@@ -283,55 +461,156 @@ class App():
                 self._screen_size = (event.w , event.h)
                 self._shadow_surface = pygame.Surface((self.screen_width, self.screen_height)).convert()                                   
 
-            # if event.type==self._EVENT_CAPTURE_FRAME:
-            #     pass
+            if event.type==self._EVENT_CAPTURE_FRAME:
+                self._capture_pending = True
 
             if callable(self._on_event_cb):
                 self._on_event_cb(event)
 
         self._idle_ticks += 1
 
+    def _run_updates(self):
+        now = self.get_ticks()
+        if self._last_update_ticks is None:
+            self._last_update_ticks = now
+        self._update_accumulator += now - self._last_update_ticks
+        self._last_update_ticks = now
+
+        step = 1000.0 / self._update_rate
+        steps = 0
+        while self._update_accumulator >= step:
+            if steps >= self._max_update_steps:
+                # can't keep up, drop the backlog instead of spiraling
+                self._update_accumulator %= step
+                break
+            self._on_update_cb(step / 1000.0)
+            self._update_accumulator -= step
+            steps += 1
+        self.interpolation_alpha = self._update_accumulator / step
+
+    def get_ticks(self):
+        """ milliseconds on the app clock: live (or virtual when headless),
+            the recorded clock while replaying
+        """
+        return self._tick_source() + self._ticks_offset
+
+    def _set_tick_source(self, source, offset=None):
+        """ switch the clock get_ticks reads, offset=None continues from the
+            current ticks, otherwise pending timers are moved by the jump
+        """
+        old_ticks = self.get_ticks()
+        self._tick_source = source
+        if offset is None:
+            self._ticks_offset = old_ticks - source()
+            return
+        self._ticks_offset = offset
+        delta = self.get_ticks() - old_ticks
+        if delta:
+            self._scheduler.rebase(delta)
+            if self._anim_start is not None:
+                self._anim_start += delta
+
+    def _get_headless_ticks(self):
+        return int(self._headless_ticks)
+
+    def _init(self):
+        if not self._initialized:
+            self._initialized = True
+            self._init_pygame()
+            if self._on_init_cb is not None:
+                self._on_init_cb()        
+
     def run(self):
         """ main pygame loop 
         """
-        self._init_pygame()
-
-        if self._on_init_cb is not None:
-            self._on_init_cb()        
-        
+        self._init()
         while self._is_running:
-            when = timer()
-
-            self._dispatch_events()
-
-            if self._clear_screen:
-                self._screen.fill(self._bgcolor)
-
-            if self._on_pre_draw_cb is not None:
-                self._on_pre_draw_cb()
-
-            # display shadow
-            shadow = self._shadow_surface
-            shadow.fill((0,0,0))
-            shadow_color = (25, 23, 19)            
-            if not self._hide_gui:
-                for control in [ctrl for ctrl in self._controls if ctrl._visible and ctrl._drop_shadow and isinstance(ctrl, BaseControl)]:    
-                    sh_off = self._shadow_offset            
-                    pygame.draw.rect(shadow, shadow_color, (control.right, control.y + sh_off, sh_off, control.height))
-                    pygame.draw.rect(shadow, shadow_color, (control.x+sh_off, control.bottom, control.width, sh_off))
-                self._screen.blit(shadow, (0, 0), special_flags=pygame.BLEND_SUB)
-                for control in [ctrl for ctrl in self._controls if ctrl._visible]:
-                    control.draw(self._screen)
-
-            if callable(self._on_draw_cb):
+            self._frame()
+        self._shutdown()
+
+    def step(self, frames=1):
+        """ render frames on demand (meant for headless apps), returns the
+            screen surface. Call close() when done
+        """
+        self._init()
+        for _ in range(frames):
+            if not self._is_running:
+                break
+            self._frame()
+        return self._screen
+
+    def close(self):
+        """ shut down an app driven by step() """
+        if self._initialized:
+            self._initialized = False
+            self._shutdown()
+
+    def save_screen(self, filename):
+        pygame.image.save(self._screen, filename)
+
+    def _frame(self):
+        when = timer()
+
+        self._scheduler.run_due()
+        self._dispatch_events()
+
+        if self._on_update_cb is not None:
+            self._run_updates()
+
+        if self._clear_screen:
+            self._screen.fill(self._bgcolor)
+
+        if self._on_pre_draw_cb is not None:
+            self._on_pre_draw_cb()
+
+        # display shadow
+        shadow = self._shadow_surface
+        shadow.fill((0,0,0))
+        shadow_color = (25, 23, 19)            
+        if not self._hide_gui:
+            for control in [ctrl for ctrl in self._controls if ctrl._visible and ctrl._drop_shadow and isinstance(ctrl, BaseControl)]:    
+                sh_off = self._shadow_offset            
+                pygame.draw.rect(shadow, shadow_color, (control.right, control.y + sh_off, sh_off, control.height))
+                pygame.draw.rect(shadow, shadow_color, (control.x+sh_off, control.bottom, control.width, sh_off))
+            self._screen.blit(shadow, (0, 0), special_flags=pygame.BLEND_SUB)
+            for control in [ctrl for ctrl in self._controls if ctrl._visible]:
+                control.draw(self._screen)
+
+        if callable(self._on_draw_cb):
+            if self._on_draw_alpha:
+                self._on_draw_cb(self.interpolation_alpha)
+            else:
                 self._on_draw_cb()
 
-            pygame.display.flip()
-            took = timer() - when
+        if self._capture_pending:
+            self._capture_pending = False
+            self._capture_gif_frame()
+        if self._finishing_encoders:
+            self._reap_encoders()
 
-            self._clock.tick(self._fps)            
-            self.metrics_fps = 1.0 / took            
+        if not self._headless:
+            pygame.display.flip()
+        took = timer() - when
 
+        if self._headless:
+            # no frame limit, the virtual clock advances as if running at fps
+            frame_ms = self._clock.tick()
+            self._headless_ticks += 1000.0 / self._fps if self._fps else frame_ms
+        else:
+            frame_ms = self._clock.tick(self._fps)            
+        self.metrics_work_fps = 1.0 / took # how fast frames could be made
+        self.metrics_fps = 1000.0 / frame_ms if frame_ms else self.metrics_work_fps
+
+    def _shutdown(self):
+        if self._frame_encoder is not None:
+            self._stop_capture()
+        for encoder in self._finishing_encoders:
+            encoder.wait()
+        self._reap_encoders()
+        if self._recorder is not None:
+            self._recorder.close()
+        if isinstance(self._conf, Config):
+            self._conf.close()
         print('exited')
         pygame.quit()
 
@@ -345,31 +624,48 @@ class App():
     def blit(self, surf, where=(0,0), *args, **kwargs):
         self.screen.blit(surf, where, *args, **kwargs)
 
-    def capture_gif(self, duration_secs, fps=5, rect=None):
+    def capture_gif(self, duration_secs, fps=5, rect=None, filename="capture.gif", loop=0):
+        """ record the screen (or rect of it) for duration_secs to an animated gif
+            (or apng if filename ends with .png), encoding runs in the background
+        """
+        if self._frame_encoder is not None:
+            self._stop_capture()
         self._gif_frame_delay = 1000 // int(fps)
         self._capture_ends = self.get_ticks() + duration_secs*1000
         if rect is None:
             self._gif_rect = self.screen.get_rect()
         else:
-            self._gif_rect = rect
+            self._gif_rect = pygame.Rect(rect).clip(self.screen.get_rect())
+        self._frame_encoder = FrameEncoder(filename, self._gif_rect.size, frame_delay=self._gif_frame_delay, loop=loop)
         self.resume_event(self._EVENT_CAPTURE_FRAME, millis=self._gif_frame_delay, once=False)
 
+    @property
+    def is_capturing(self):
+        return self._frame_encoder is not None
+
+    def _stop_capture(self, wait=False):
+        self.pause_event(self._EVENT_CAPTURE_FRAME)
+        encoder = self._frame_encoder
+        self._frame_encoder = None
+        encoder.finish(wait=wait)
+        if encoder.dropped_frames:
+            print('capture dropped %d frames' % encoder.dropped_frames)
+        self._finishing_encoders.append(encoder)
+        self._reap_encoders()
+
+    def _reap_encoders(self):
+        """ forget finished encoders, reporting their errors on the main thread """
+        done = [enc for enc in self._finishing_encoders if enc.done]
+        for encoder in done:
+            if encoder.error is not None:
+                print('capture to %s failed: %s' % (encoder.filename, encoder.error))
+            elif encoder.truncated_frames:
+                print('capture to %s truncated, %d frames over the memory limit' % (encoder.filename, encoder.truncated_frames))
+        self._finishing_encoders = [enc for enc in self._finishing_encoders if enc not in done]
+
     def _capture_gif_frame(self):
-        frame_no = getattr(self, '_frame_no', 1)
-        cropped = pygame.Surface(self._gif_rect[2], self._gif_rect[3])
-        cropped.blit(self.screen, (0, 0), self._gif_rect)
-        img_filename = "image_%d.png" % frame_no
-        app._frame_no = frame_no + 1
-        pygame.image.save(cropped, os.path.join("anims", img_filename))
-        
-    def _savegif(filename, source_path="anims/image_*.png", frame_delay=75, loop=1):
-        from PIL import Image        
-        #https://stackoverflow.com/questions/753190/programmatically-generate-video-or-animated-gif-in-python
-        # save series of images to gif 
-        # by Kris
-        #https://stackoverflow.com/questions/64971675/pil-adding-text-to-a-gif-frames-adds-noise-to-the-picture
-        # disable dithering 
-        # by fdermishin        
-        img, *imgs=[Image.open(f).quantize(method=Image.MEDIANCUT) for f in sorted(glob.glob(source_path))]
-        img.save(fp=filename, format='GIF', append_images=imgs,
-                save_all=True, duration=frame_delay, loop=loop)
\ No newline at end of file
+        if self._frame_encoder is None:
+            return
+        self._frame_encoder.push(self.screen.subsurface(self._gif_rect))
+        if self.get_ticks() >= self._capture_ends:
+            self._stop_capture()
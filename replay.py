@@ -0,0 +1,105 @@
+import marshal
+import struct
+
+import pygame
+
+_MAGIC = b"PYEREC01"
+_FRAME = struct.Struct("<BII")  # kind, frame number, ticks
+_EVENT = struct.Struct("<BIH")  # kind, event type, payload length
+_KIND_FRAME, _KIND_EVENT = range(1, 3)
+_PLAIN_TYPES = (int, float, str, bool, bytes, type(None))
+
+
+def _event_payload(event):
+    """ marshal the event attributes that can be restored (drops window objects etc.) """
+    attrs = {}
+    for key, value in event.dict.items():
+        if isinstance(value, _PLAIN_TYPES) or (isinstance(value, tuple) and all(isinstance(v, _PLAIN_TYPES) for v in value)):
+            attrs[key] = value
+    return marshal.dumps(attrs)
+
+
+class EventRecorder():
+    """ Writes the event stream of an App to a compact binary log
+        every frame is stored as a frame record (frame number, ticks)
+        followed by its events, see EventPlayer for playback
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        self._f = open(filename, "wb")
+        self._f.write(_MAGIC)
+        self.event_count = 0
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def record_frame(self, frame_no, ticks, events):
+        write = self._f.write
+        write(_FRAME.pack(_KIND_FRAME, frame_no, ticks))
+        for event in events:
+            payload = _event_payload(event)
+            write(_EVENT.pack(_KIND_EVENT, event.type, len(payload)))
+            write(payload)
+        self.event_count += len(events)
+
+    def close(self):
+        if not self._f.closed:
+            self._f.close()
+
+
+class EventPlayer():
+    """ Plays back a log written by EventRecorder frame by frame
+        get_ticks() is a virtual clock returning the recorded ticks of the
+        current frame, so timing dependent code (double clicks etc.) replays
+        the same way regardless of how fast frames are rendered
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        with open(filename, "rb") as f:
+            data = f.read()
+        if not data.startswith(_MAGIC):
+            raise ValueError("%s is not an event recording" % filename)
+        self._frames = [] # (frame number, ticks, [events])
+        pos = len(_MAGIC)
+        while pos < len(data):
+            kind = data[pos]
+            if kind==_KIND_FRAME:
+                _, frame_no, ticks = _FRAME.unpack_from(data, pos)
+                pos += _FRAME.size
+                self._frames.append((frame_no, ticks, []))
+            elif kind==_KIND_EVENT:
+                _, event_type, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                attrs = marshal.loads(data[pos:pos+length])
+                pos += length
+                self._frames[-1][2].append(pygame.event.Event(event_type, attrs))
+            else:
+                raise ValueError("%s: corrupted record at %d" % (filename, pos))
+        self._cursor = 0
+        self._ticks = self._frames[0][1] if self._frames else 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def finished(self):
+        return self._cursor >= len(self._frames)
+
+    @property
+    def frame_no(self):
+        return self._cursor
+
+    def get_ticks(self):
+        return self._ticks
+
+    def next_frame(self):
+        """ events of the next recorded frame (empty list once finished) """
+        if self.finished:
+            return []
+        _, self._ticks, events = self._frames[self._cursor]
+        self._cursor += 1
+        return events
+
+    def rewind(self):
+        self._cursor = 0
@@ -0,0 +1,136 @@
+import heapq
+import itertools
+
+
+class ScheduledCall():
+    """ handle returned by Scheduler.call_later/call_every """
+    __slots__ = ('callback', 'args', 'interval', 'due', 'repeat', 'cancelled', 'paused', '_seq')
+
+    def __init__(self, callback, args, interval, repeat):
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.repeat = repeat
+        self.due = 0
+        self.cancelled = False
+        self.paused = False
+        self._seq = None
+
+    @property
+    def active(self):
+        return not (self.cancelled or self.paused)
+
+    def __repr__(self):
+        return "<ScheduledCall %r due=%d interval=%d%s>" % (self.callback, self.due, self.interval,
+                                                              " cancelled" if self.cancelled else " paused" if self.paused else "")
+
+
+class Scheduler():
+    """ Heap based timer queue driven from the main loop
+
+        clock is a function returning milliseconds (App.get_ticks). run_due()
+        fires every callback whose time has come, repeating calls are then
+        rescheduled. Cancelled and paused calls are dropped lazily when they
+        reach the top of the heap, so cancelling is O(1).
+    """
+    def __init__(self, clock):
+        self._clock = clock
+        self._heap = [] # (due, seq, call)
+        self._seq = itertools.count()
+        self._active = 0
+
+    def __len__(self):
+        """ number of scheduled (not paused or cancelled) calls """
+        return self._active
+
+    def _push(self, call, due):
+        call.due = due
+        call._seq = next(self._seq)
+        heapq.heappush(self._heap, (due, call._seq, call))
+
+    def call_later(self, delay, callback, *args):
+        """ call callback(*args) once after delay ms """
+        call = ScheduledCall(callback, args, delay, False)
+        self._push(call, self._clock() + delay)
+        self._active += 1
+        return call
+
+    def call_every(self, interval, callback, *args):
+        """ call callback(*args) every interval ms until cancelled """
+        if interval <= 0:
+            raise ValueError('interval has to be > 0')
+        call = ScheduledCall(callback, args, interval, True)
+        self._push(call, self._clock() + interval)
+        self._active += 1
+        return call
+
+    def cancel(self, call):
+        if not call.cancelled:
+            if not call.paused:
+                self._active -= 1
+            call.cancelled = True
+            call._seq = None
+
+    def pause(self, call):
+        if call.active:
+            call.paused = True
+            call._seq = None
+            self._active -= 1
+
+    def resume(self, call, interval=None):
+        """ restart a paused call, its delay/interval counts from now """
+        if call.cancelled:
+            raise ValueError('cancelled calls can not be resumed')
+        if interval is not None:
+            call.interval = interval
+        if not call.paused and call._seq is not None:
+            return
+        call.paused = False
+        self._push(call, self._clock() + call.interval)
+        self._active += 1
+
+    def next_due(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap and heap[0][2]._seq != heap[0][1]:
+            heapq.heappop(heap)
+
+    def run_due(self, now=None):
+        """ fire due callbacks, returns how many were called """
+        if now is None:
+            now = self._clock()
+        heap = self._heap
+        fired = 0
+        while heap and heap[0][0] <= now:
+            due, seq, call = heapq.heappop(heap)
+            if call._seq != seq:
+                continue # cancelled, paused or rescheduled
+            if call.repeat:
+                # run once even if several intervals were missed
+                next_due = due + call.interval
+                if next_due <= now:
+                    next_due = now + call.interval
+                self._push(call, next_due)
+            else:
+                call._seq = None
+                call.cancelled = True
+                self._active -= 1
+            call.callback(*call.args)
+            fired += 1
+        return fired
+
+    def rebase(self, delta):
+        """ shift every pending due time by delta ms, used when the clock is
+            switched so the remaining delays are kept
+        """
+        for i, (due, seq, call) in enumerate(self._heap):
+            self._heap[i] = (due + delta, seq, call)
+            if call._seq == seq:
+                call.due = due + delta
+
+    def clear(self):
+        self._heap = []
+        self._active = 0
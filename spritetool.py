@@ -0,0 +1,153 @@
+""" Batch sprite processing from the command line
+
+    Applies the SpriteSheet transforms (colorkey, darken, scale) and slicing
+    to image files or whole directories, one sheet per worker process:
+
+        python spritetool.py sheets/ -o out/ --colorkey auto --darken 40 --scale 2 --slice 16x16
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+
+import pygame
+
+from draw_utils import darken_surface, scale_surface, colorkey_to_alpha, slice_sheet
+
+
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.gif', '.jpg', '.jpeg', '.tga')
+
+
+def save_atomic(surf, filename):
+    """ save through a temp file in the same directory, so readers never
+        see a half written image
+    """
+    base, ext = os.path.splitext(filename)
+    tmp_fn = "%s.tmp%d%s" % (base, os.getpid(), ext)
+    try:
+        pygame.image.save(surf, tmp_fn)
+        os.replace(tmp_fn, filename)
+    finally:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+
+
+def process_image(src_fn, dst_fn, colorkey=None, darken=None, scale=None, sprite_size=None, skip_empty=False):
+    """ transform one image in the order SpriteSheet does (colorkey, darken,
+        scale) and save it, or its frames if sprite_size is given
+        returns the written file names
+    """
+    surf = pygame.image.load(src_fn)
+    if colorkey is not None:
+        surf = colorkey_to_alpha(surf, None if colorkey=='auto' else colorkey)
+    if darken:
+        surf = darken_surface(surf, darken)
+    if scale is not None and scale != 1:
+        surf = scale_surface(surf, scale)
+        if sprite_size is not None:
+            sprite_size = (int(sprite_size[0]*scale), int(sprite_size[1]*scale))
+
+    os.makedirs(os.path.dirname(dst_fn) or '.', exist_ok=True)
+    if sprite_size is None:
+        save_atomic(surf, dst_fn)
+        return [dst_fn]
+
+    base, ext = os.path.splitext(dst_fn)
+    os.makedirs(base, exist_ok=True)
+    written = []
+    for idx, sprite in enumerate(slice_sheet(surf, sprite_size, skip_empty)):
+        if sprite is None:
+            continue
+        frame_fn = os.path.join(base, "%s_%03d%s" % (os.path.basename(base), idx, ext))
+        save_atomic(sprite, frame_fn)
+        written.append(frame_fn)
+    return written
+
+
+def _run_job(job):
+    src_fn, dst_fn, kwargs = job
+    try:
+        return src_fn, process_image(src_fn, dst_fn, **kwargs), None
+    except Exception as e:
+        return src_fn, [], "%s: %s" % (type(e).__name__, e)
+
+
+def collect_images(inputs, out_dir, recursive=False, ext=None):
+    """ (src, dst) pairs, directory inputs keep their relative layout in out_dir """
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                if not recursive:
+                    dirs[:] = []
+                for fn in sorted(files):
+                    if os.path.splitext(fn)[1].lower() in IMAGE_EXTENSIONS:
+                        src_fn = os.path.join(root, fn)
+                        jobs.append((src_fn, os.path.join(out_dir, os.path.relpath(src_fn, path))))
+        elif os.path.isfile(path):
+            jobs.append((path, os.path.join(out_dir, os.path.basename(path))))
+        else:
+            raise ValueError('no such file or directory: %s' % path)
+    if ext is not None:
+        jobs = [(src_fn, os.path.splitext(dst_fn)[0] + ext) for src_fn, dst_fn in jobs]
+    return jobs
+
+
+def _parse_color(value):
+    if value == 'auto':
+        return value
+    try:
+        color = tuple(int(c) for c in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError('color has to be auto or r,g,b')
+    if len(color) != 3:
+        raise argparse.ArgumentTypeError('color has to be auto or r,g,b')
+    return color
+
+
+def _parse_size(value):
+    try:
+        width, height = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('size has to be WxH')
+    return width, height
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch process sprite sheets")
+    parser.add_argument('inputs', nargs='+', help="image files or directories")
+    parser.add_argument('-o', '--out', required=True, help="output directory")
+    parser.add_argument('-r', '--recursive', action='store_true', help="descend into subdirectories")
+    parser.add_argument('--colorkey', type=_parse_color, help="make r,g,b (or the top left pixel: auto) transparent")
+    parser.add_argument('--darken', type=int, help="subtract from every color channel")
+    parser.add_argument('--scale', type=float, help="scale factor")
+    parser.add_argument('--slice', type=_parse_size, metavar='WxH', help="write the frames of a WxH grid")
+    parser.add_argument('--skip-empty', action='store_true', help="don't write empty frames")
+    parser.add_argument('--ext', help="output format, e.g. .png (default: keep)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    kwargs = dict(colorkey=args.colorkey, darken=args.darken, scale=args.scale,
+                  sprite_size=args.slice, skip_empty=args.skip_empty)
+    jobs = [(src_fn, dst_fn, kwargs) for src_fn, dst_fn in collect_images(args.inputs, args.out, args.recursive, args.ext)]
+    if not jobs:
+        print("No images found")
+        return 1
+
+    failed = 0
+    written = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for src_fn, files, error in pool.map(_run_job, jobs, chunksize=max(1, len(jobs) // 64)):
+            if error is not None:
+                failed += 1
+                print("Failed:", src_fn, error)
+            else:
+                written += len(files)
+    print("Processed %d images, wrote %d files, %d failed" % (len(jobs) - failed, written, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,34 +1,49 @@
+import csv
+import json
 import os
 import types
 import weakref
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pygame
 from functools import lru_cache
 
 from draw_utils import *
+from conf import Config
 
 __all__ = ['BaseControl', 'Layout', 'DrawingBoard','MainMenu', 'HorizontalLayout', 'VerticalLayout', 'ColorCell', 'Spacer', 'ToolPanel', 'StatusBar', 'VerticalLine', 'YesNoDialog',
-           'HorizontalLine', 'SliderCtrl', 'SpriteSheetCtrl', 'SpritePreview', 'Label', 'ButtonCtrl', 'SpriteSheet', 'FileDialog', 'ROI', 'TextEntry']
+           'HorizontalLine', 'SliderCtrl', 'SpriteSheetCtrl', 'SpritePreview', 'Label', 'ButtonCtrl', 'SpriteSheet', 'AtlasSpriteSheet', 'FileDialog', 'ROI', 'ROICollection', 'TextEntry', 'ListView', 'GridView']
 
 def save_to_conf(f):
+    attr = f.__name__
     def wrapped(*args, **kwargs):        
         self = args[0]
         value = args[1]
         res = f(*args, **kwargs)
-        if self._conf is not None:
+        conf = self._conf
+        if conf is not None:
             if self._name is not None:
                 if isinstance(value, pygame.Color):
                     value = (value.r, value.g, value.b)                              
-                setattr(self._conf, "%s_%s" % (self._name, f.__name__), value)
+                if isinstance(conf, Config):
+                    conf.store(self._name, attr, value)
+                else:
+                    setattr(conf, "%s_%s" % (self._name, attr), value)
         return res
     return wrapped
 
 def load_from_conf(f):
+    attr = f.__name__
     def wrapped(*args, **kwargs):        
         self = args[0]
         res = f(*args, **kwargs)
-        if self._conf is not None and self._name is not None:
-            res2 = getattr(self._conf, "%s_%s" % (self._name, f.__name__), None)
+        conf = self._conf
+        if conf is not None and self._name is not None:
+            if isinstance(conf, Config):
+                res2 = conf.lookup(self._name, attr)
+            else:
+                res2 = getattr(conf, "%s_%s" % (self._name, attr), None)
             if res2 is not None:
                 return res2
 
@@ -48,6 +63,11 @@ class Region():
     ALIGN_LEFT,
     ALIGN_CENTER,
     *_) = range(2)
+    # _x and _y are relative to _origin(), absolute positions are cached, so
+    # moving a container is O(1). A move invalidates the caches of its scope
+    # (the top level region it belongs to) only, _generation invalidates all
+    # of them and is bumped on layout/owner changes and moves of root regions
+    _generation = 0
     def __init__(self, x, y, width, height, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._x = x
@@ -57,6 +77,13 @@ class Region():
         self._layout = None
         self._parent = None
         self._layer = 1
+        self._owner = None
+        self._scope_gen = 0 # bumped when a region in this scope moves
+        self._scope_at = -1
+        self._scope_region = None
+        self._abs_key = None
+        self._abs_x = None
+        self._abs_y = None
 
     def move_infront_of(self, region):
         self._layer = region._layer + 1
@@ -80,19 +107,88 @@ class Region():
 
     @property
     def y(self):
-        return self._y    
+        return self._abs_pos()[1]
 
     @property
     def x(self):
-        return self._x
+        return self._abs_pos()[0]
 
     @x.setter
     def x(self, val):
-        self._x = val
+        self._set_x(val)
 
     @y.setter
     def y(self, value):
-        self._y = value
+        self._set_y(value)
+
+    def _origin(self):
+        """ the region _x and _y are relative to: the layout, else the owner """
+        if self._layout is not None:
+            return self._layout()
+        if self._owner is not None:
+            return self._owner()
+        return None
+
+    def _scope(self):
+        """ the ancestor right below the root this region is positioned in,
+            None for a root itself
+        """
+        if self._scope_at != Region._generation:
+            region, origin = self, self._origin()
+            if origin is not None:
+                up = origin._origin()
+                while up is not None:
+                    region, origin, up = origin, up, up._origin()
+                self._scope_region = region
+            else:
+                self._scope_region = None
+            self._scope_at = Region._generation
+        return self._scope_region
+
+    def _moved(self):
+        scope = self._scope()
+        if scope is None:
+            Region._generation += 1
+        else:
+            scope._scope_gen += 1
+
+    def _abs_pos(self):
+        """ absolute position, recomputed only after something in its scope has moved """
+        scope = self._scope()
+        key = (Region._generation, 0 if scope is None else scope._scope_gen)
+        if self._abs_key != key:
+            origin = self._origin()
+            org_x, org_y = (None, None) if origin is None else origin._abs_pos()
+            self._abs_x = self._x if self._x is None or org_x is None else org_x + self._x
+            self._abs_y = self._y if self._y is None or org_y is None else org_y + self._y
+            self._abs_key = key
+        return self._abs_x, self._abs_y
+
+    def _set_x(self, val):
+        origin = self._origin()
+        org_x = None if origin is None else origin._abs_pos()[0]
+        if val is not None and org_x is not None:
+            val -= org_x
+        if val != self._x:
+            self._x = val
+            self._moved()
+
+    def _set_y(self, val):
+        origin = self._origin()
+        org_y = None if origin is None else origin._abs_pos()[1]
+        if val is not None and org_y is not None:
+            val -= org_y
+        if val != self._y:
+            self._y = val
+            self._moved()
+
+    def _reattach(self, attr, region):
+        """ change the layout or owner keeping the absolute position """
+        x, y = self._abs_pos()
+        setattr(self, attr, None if region is None else weakref.ref(region))
+        Region._generation += 1
+        self._set_x(x)
+        self._set_y(y)
 
 
     @bottom.setter
@@ -131,10 +227,7 @@ class Region():
         
     @layout.setter
     def layout(self, layout):
-        if layout is not None:
-            self._layout = weakref.ref(layout)
-        else:
-            self._layout = None
+        self._reattach('_layout', layout)
 
     @property
     def parent(self):
@@ -187,10 +280,14 @@ class BaseGrid():
 
 class BaseControl(Region):
     """ Base class for all UI controls
+        controls that implement render() instead of draw() can be switched to
+        retained mode: they are rendered once into an owned surface and only
+        re-rendered when _dirty is set (see makes_dirty) or their size changes
     """
     DRAG_MODE_BODY = 999
+    retained_stats = dict(hits=0, renders=0) # totals over all retained controls
 
-    def __init__(self, x, y, width=8, height=8, color=None, conf=None, *args, **kwargs):
+    def __init__(self, x, y, width=8, height=8, color=None, conf=None, retained=False, *args, **kwargs):
         super().__init__(x, y, width, height, *args, **kwargs)                
         self._app = None
         self._conf = conf
@@ -202,9 +299,19 @@ class BaseControl(Region):
         self._drop_shadow = True
         self._selectable = False
         self._dirty = True # sometimes used        
+        self._theme = None
+        self._palette = None
+        self._palette_src = None
+        self._retained = retained
+        self._retained_surface = None
+        self._retained_key_val = None
+        self._retained_hits = 0
+        self._retained_renders = 0
         self._on_click_cb = None
         self._on_doubleclick_cb = None
         self._on_drag_move_cb = None
+        self._on_drag_path_cb = None
+        self._motion_path = False # receive every sub-frame mouse position while dragged
         self._on_keypress_cb = None
     @property
     def selected(self):
@@ -237,21 +344,122 @@ class BaseControl(Region):
         return self._color
 
     @color.setter
+    @makes_dirty
     def color(self, color):
         if isinstance(color, pygame.Color):
             color = (color.r, color.g, color.b)
         self._color = color
 
+    @property
+    def retained(self):
+        return self._retained
+
+    @retained.setter
+    @makes_dirty
+    def retained(self, value):
+        self._retained = bool(value)
+        if not self._retained:
+            self._retained_surface = None
+
+    @property
+    def retained_cache_stats(self):
+        """ (hits, renders) of this control's retained surface """
+        return self._retained_hits, self._retained_renders
+
+    def render(self, surf, x, y):
+        """ draw the control at x, y
+            implement this rather than draw() to support retained mode
+        """
+        raise NotImplementedError("%s has to implement render() or draw()" % self.__class__.__name__)
+
+    def _retained_key(self):
+        """ anything besides _dirty that requires a re-render when it changes """
+        return (self.width, self.height)
+
+    def draw(self, surf):
+        x, y = self.x, self.y
+        if not self._retained:
+            self.render(surf, x, y)
+            return
+
+        key = self._retained_key()
+        if self._dirty or self._retained_surface is None or key!=self._retained_key_val:
+            size = (max(1, self.width+1), max(1, self.height+1))
+            if self._retained_surface is None or self._retained_surface.get_size()!=size:
+                self._retained_surface = pygame.Surface(size, pygame.SRCALPHA)
+                if pygame.display.get_surface() is not None:
+                    self._retained_surface = self._retained_surface.convert_alpha()
+            self._retained_surface.fill((0, 0, 0, 0))
+            self.render(self._retained_surface, 0, 0)
+            self._retained_key_val = key
+            self._dirty = False
+            self._retained_renders += 1
+            BaseControl.retained_stats['renders'] += 1
+        else:
+            self._retained_hits += 1
+            BaseControl.retained_stats['hits'] += 1
+        surf.blit(self._retained_surface, (x, y))
+
+    @property
+    def theme(self):
+        return DEFAULT_THEME if self._theme is None else self._theme
+
+    @theme.setter
+    def theme(self, theme):
+        self._theme = theme
+        self._palette = None
+        self._dirty = True
+
+    @property
+    def palette(self):
+        """ shades of the control color, resolved once per color/theme change
+            instead of on every draw
+        """
+        if self._palette is None or self._palette_src is not self._color:
+            self._palette = self.theme.palette(self._color)
+            self._palette_src = self._color
+        return self._palette
+
     @property
     def app(self):
         """ reference to application object
         """
         return self._app
 
+    def get_ticks(self):
+        """ ticks of the app clock this control (or a parent) is attached to,
+            so animations follow the recorded clock while replaying
+        """
+        control = self
+        while control is not None:
+            app = getattr(control, '_app', None)
+            if app is not None:
+                return app.get_ticks()
+            control = control.parent
+        return get_ticks()
+
     def on_drag_move(self, f_cb):
         self._on_drag_move_cb = types.MethodType(f_cb, self)
     on_drag_move = property(fset=on_drag_move)        
 
+    def on_drag_path(self, f_cb):
+        """ f(mode, path, app, button), path is [(x, y, x_rel, y_rel), ..]
+            all mouse positions since the last frame, needs motion_path
+        """
+        self._on_drag_path_cb = types.MethodType(f_cb, self)
+    on_drag_path = property(fset=on_drag_path)
+
+    @property
+    def motion_path(self):
+        """ if set, App doesn't coalesce mouse motion for this control
+            and calls drag_path with the full path instead of drag_move
+        """
+        return self._motion_path
+
+    @motion_path.setter
+    def motion_path(self, value):
+        self._motion_path = bool(value)
+
     def on_click(self, f_cb):
         """ property to assign on click callback """
         self._on_click_cb = types.MethodType(f_cb, self)
@@ -282,6 +490,14 @@ class BaseControl(Region):
         if self._on_drag_move_cb is not None:
             self._on_drag_move_cb(mode, x, y, x_rel, y_rel, app, button)
 
+    def drag_path(self, mode, path, app, button):
+        """ called instead of drag_move for motion_path controls """
+        if self._on_drag_path_cb is not None:
+            self._on_drag_path_cb(mode, path, app, button)
+        else:
+            for x, y, x_rel, y_rel in path:
+                self.drag_move(mode, x, y, x_rel, y_rel, app, button)
+
     def key_pressed(self, key, app):
         if self._on_keypress_cb is not None:
             self._on_keypress_cb( key, app)
@@ -356,9 +572,9 @@ class Layout(Region):
             val._set_parent(self.parent)
 
         if self._y is None:
-            self._y = val.y
+            self._set_y(val.y)
         if self._x is None:
-            self._x = val.x
+            self._set_x(val.x)
         self._items.append(val)
         val.layout = self
         self._is_sorted = False
@@ -369,24 +585,14 @@ class Layout(Region):
         val.layout = None        
         return val
 
+    def _set_owner(self, control):
+        """ make the layout relative to control, for the _controls of composite controls """
+        self._reattach('_owner', control)
+
     @property
     def spacing(self):
         return self._spacing
 
-    @Region.y.setter
-    def y(self, val):
-        for item in self._items:
-            if item.y is not None:
-                item.y += (val-self._y)
-        self._y = val
-    
-    @Region.x.setter
-    def x(self, val):
-        for item in self._items:
-            if item.x is not None:
-                item.x += (val-self._x)
-        self._x = val
-
     def _re_align(self):
         pass            
     
@@ -464,16 +670,12 @@ class SpriteSheet(BaseGrid):
         sprite_w, sprite_h = self._sprite_size
 
         if self._darker is not None:
-            darken = pygame.Surface(self._image.get_size()).convert()
-            darken.fill((self._darker, self._darker, self._darker))
-            self._image = self._image.copy()
-            self._image.blit(darken, (0,0), special_flags=pygame.BLEND_RGB_SUB)            
+            self._image = darken_surface(self._image, self._darker)
 
         if self._scale is not None:
-            size = self._image.get_size()
             sprite_w = int(sprite_w * self._scale)
             sprite_h = int(sprite_h * self._scale)
-            self._image = pygame.transform.scale(self._image, ( int(size[0]*self._scale), int(size[1]*self._scale) ) )
+            self._image = scale_surface(self._image, self._scale)
         
         for row in range(self._rows):            
             for col in range(self._cols):
@@ -483,6 +685,14 @@ class SpriteSheet(BaseGrid):
         #print(self, '__getitem__', idx, self._sprites)
         return self._sprites[idx]                 
 
+    def dedupe(self, variants=True):
+        """ find duplicate (and flipped/turned, see TileSet) sprites, equal
+            sprites then share one surface, returns the TileSet
+        """
+        tile_set = TileSet.from_surface(self._image, self._sprites[0].get_size(), variants)
+        self._sprites = [tile_set.cell(col, row) for row in range(self._rows) for col in range(self._cols)]
+        return tile_set
+
     def render_sprites(self, surf, spriteids_list, x, y):
         cur_y = y
         sprite_w, sprite_h = self[0].get_size()
@@ -495,6 +705,81 @@ class SpriteSheet(BaseGrid):
             cur_y += sprite_h
         return (cur_x-x, cur_y-y) # size of the sprites area
 
+class AtlasSpriteSheet():
+    """ sprites packed by atlas.AtlasBuilder, looked up by name
+        sheet[name] is the trimmed sprite, blit() draws it where the
+        untrimmed sprite would be
+    """
+    _page_imgs = {}
+    def __init__(self, meta_fn):
+        with open(meta_fn) as f:
+            meta = json.load(f)
+        pages = []
+        for page_fn in meta['pages']:
+            page_fn = os.path.join(os.path.dirname(meta_fn), page_fn)
+            if not page_fn in self.__class__._page_imgs:
+                print("Loading:", page_fn)
+                img = pygame.image.load(page_fn)
+                if pygame.display.get_surface() is not None:
+                    img = img.convert_alpha()
+                self.__class__._page_imgs[page_fn] = img
+            pages.append(self.__class__._page_imgs[page_fn])
+        self._pages = pages
+        self._sprites = {}
+        self._offsets = {}
+        self._sizes = {}
+        for name, entry in meta['sprites'].items():
+            self._sprites[name] = pages[entry['page']].subsurface(entry['rect'])
+            self._offsets[name] = tuple(entry['offset'])
+            self._sizes[name] = tuple(entry['size'])
+
+    @property
+    def pages(self):
+        return self._pages
+
+    def __getitem__(self, name):
+        return self._sprites[name]
+
+    def __contains__(self, name):
+        return name in self._sprites
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def names(self):
+        return self._sprites.keys()
+
+    def offset(self, name):
+        """ trimmed sprite position within the original sprite """
+        return self._offsets[name]
+
+    def sprite_size(self, name):
+        """ size of the original (untrimmed) sprite """
+        return self._sizes[name]
+
+    def blit(self, surf, name, x, y):
+        o_x, o_y = self._offsets[name]
+        surf.blit(self._sprites[name], (x + o_x, y + o_y))
+
+    def render_sprites(self, surf, names_list, x, y):
+        """ like SpriteSheet.render_sprites, rows of names (or None) laid
+            out by their original sprite size
+        """
+        cur_y = y
+        width = 0
+        for scanline in names_list:
+            cur_x = x
+            row_h = 0
+            for name in scanline:
+                if name is not None:
+                    self.blit(surf, name, cur_x, cur_y)
+                    w, h = self._sizes[name]
+                    cur_x += w
+                    row_h = max(row_h, h)
+            width = max(width, cur_x - x)
+            cur_y += row_h
+        return (width, cur_y-y) # size of the sprites area
+
 class VerticalLayout(Layout):
     def __init__(self, x=None, y=None, spacing=2):
         super().__init__(x, y, spacing)
@@ -625,8 +910,9 @@ class DrawingBoard(BaseControl, BaseGrid):
     DRAW_GRID_AT_ZOOM = 5
     MAX_ZOOM = 32
     COLOR_GRID_TINT = (33,32,29)
-    def  __init__(self, size, color=COLOR_GRID, zoom=4, max_width=None, **kwargs):
+    def  __init__(self, size, color=COLOR_GRID, zoom=4, max_width=None, palette=None, **kwargs):
         super().__init__(0, 0, 0, 0, color, cols=size[0], rows=size[1], **kwargs)
+        self._image_palette = palette # indexed 8-bit mode if set
         
         if max_width is not None:
             for z in range(1,self.MAX_ZOOM+1):
@@ -639,6 +925,8 @@ class DrawingBoard(BaseControl, BaseGrid):
         self.size = size        
         self._onion_skin = None
         self._on_painted_cb = None
+        self._motion_path = True # strokes need every mouse position
+        self._dirty_cells = None # grid rect to redraw when not fully _dirty
 
     def on_painted(self, f_cb):
         """ property to assign on painted callback """
@@ -656,11 +944,56 @@ class DrawingBoard(BaseControl, BaseGrid):
         if not isinstance(value, (list, tuple)):
             raise TypeError('size val has to be list or tuple :P')
         self._size = value
-        self._grid_image = pygame.Surface(self._size).convert()
-        self._grid_image.fill( self._color )
+        self._layers = LayerStack(self._size, self._color, self._image_palette)
+        self._layers_generation = None
         self._cols = self._size[0]
         self._rows = self._size[1]
 
+    @property
+    def _grid_image(self):
+        """ the surface of the active layer, painting goes there """
+        return self._layers.active_layer.surface
+
+    @property
+    def layers(self):
+        """ LayerStack of the board, layers are edited in place """
+        return self._layers
+
+    def add_layer(self, name=None, index=None, visible=True, opacity=255, blend='normal'):
+        """ add a transparent layer (on top by default) and make it active """
+        return self._layers.add_layer(name=name, index=index, visible=visible, opacity=opacity, blend=blend)
+
+    def remove_layer(self, index):
+        return self._layers.remove_layer(index)
+
+    @property
+    def is_indexed(self):
+        return is_indexed(self._grid_image)
+
+    @property
+    def image_palette(self):
+        """ colors of an indexed board, None otherwise """
+        return self._layers.palette
+
+    def set_palette_color(self, index, color):
+        """ recolor all cells of palette index """
+        self._layers.set_palette_color(index, color)
+
+    def get_cellindex_at_pos(self, x, y):
+        """ palette index (mapped color for rgb boards) at x, y """
+        res = self.cell_at_pos(x, y)
+        if res is None:
+            return None
+        return self._grid_image.get_at_mapped(res)
+
+    @property
+    def active_layer(self):
+        return self._layers.active
+
+    @active_layer.setter
+    def active_layer(self, index):
+        self._layers.active = index
+
     @makes_dirty
     def set_image(self, surf, where=(0,0)):
         self._grid_image.blit(surf, where)
@@ -679,8 +1012,8 @@ class DrawingBoard(BaseControl, BaseGrid):
     def cell_at_pos(self, x, y, boundry_checks=True):
         """ get col, row and specified position x, y
         """
-        cell_col = (x - self._x) // self.cell_width
-        cell_row = (y - self._y) // self.cell_height
+        cell_col = (x - self.x) // self.cell_width
+        cell_row = (y - self.y) // self.cell_height
         if boundry_checks and (cell_col<0 or cell_row<0 or cell_col>(self._cols-1) or cell_row>(self._rows-1)):
             return None
         return cell_col, cell_row
@@ -708,10 +1041,41 @@ class DrawingBoard(BaseControl, BaseGrid):
             return None        
         pygame.draw.line(self._grid_image, color, p1, p2)
 
+    def stroke(self, path, brush, color):
+        """ paint brush stamps along path of screen positions, either
+            [(x, y), ..] or a drag path [(x, y, x_rel, y_rel), ..]
+            returns the dirty cell rect (only that part is redrawn) or None
+        """
+        if not len(path):
+            return None
+        points = np.asarray(path, dtype=np.float64)
+        if points.shape[1] == 4:
+            # a drag path starts where the previous frame's path ended
+            points = np.concatenate((points[:1, :2] - points[:1, 2:], points[:, :2]))
+        cells = np.floor((points - (self.x, self.y)) / self._zoom)
+        rect = stamp_path(self._grid_image, cells, brush, color)
+        if rect is not None:
+            self._dirty_cells = rect if self._dirty_cells is None else self._dirty_cells.union(rect)
+        return rect
+
+    def _redraw_cells(self, rect):
+        """ update the part of the zoomed image covering grid rect """
+        zoom = self._zoom
+        dst = pygame.Rect(rect.x*zoom, rect.y*zoom, rect.w*zoom, rect.h*zoom)
+        self._layers.update(rect)
+        flat = self._layers.composite().subsurface(rect)
+        if is_indexed(flat):
+            flat = flat.convert()
+        pygame.transform.scale(flat, dst.size, self._image.subsurface(dst))
+        if zoom > self.DRAW_GRID_AT_ZOOM:
+            grid_surf = self._make_grid_s( (self.width, self.height) )
+            self._image.blit(grid_surf, dst.topleft, dst, special_flags=pygame.BLEND_SUB)
+        pygame.draw.rect(self._image, COLOR_GRID_CELL, (0, 0, self.width, self.height), width=1)
+
     @makes_dirty
     def set_grid_image(self, new_img):
         self.size = new_img.get_size()
-        self._grid_image = new_img.copy()
+        self._layers.active_layer.surface = new_img.copy()
 
     @property
     def grid_image(self):
@@ -743,18 +1107,35 @@ class DrawingBoard(BaseControl, BaseGrid):
 
     @property
     def image(self):
+        if self._layers.generation != self._layers_generation:
+            # layers were added, removed or changed their look
+            self._layers_generation = self._layers.generation
+            self._dirty = True
+        if self._dirty_cells is not None and not self._dirty:
+            if self._onion_skin is not None:
+                self._dirty = True
+            else:
+                self._redraw_cells(self._dirty_cells)
+                if self._on_painted_cb is not None:
+                    self._on_painted_cb(self._grid_image, self.app)
+        self._dirty_cells = None
+
         if self._dirty:
             self._image = self._new_image((self.width, self.height))
+            self._layers.update()
+            flat = self._layers.composite()
+            if is_indexed(flat):
+                flat = flat.convert()
 
             if self._onion_skin is not None:
-                new_im = self._grid_image.copy()
-                new_im.set_colorkey(self._grid_image.get_at((0,0)))
+                new_im = flat.copy()
+                new_im.set_colorkey(flat.get_at((0,0)))
 
                 im = pygame.transform.average_surfaces( [ new_im, new_im, self._onion_skin ])
                 
                 im.blit(new_im, (0,0), special_flags=0)
             else:
-                im = self._grid_image
+                im = flat
             
             pygame.transform.scale(im, (self.width, self.height), self._image)
                  
@@ -794,7 +1175,7 @@ class DrawingBoard(BaseControl, BaseGrid):
         self._zoom = zoom
     
     def draw(self, surf):
-        surf.blit(self.image, (self._x, self._y))                
+        surf.blit(self.image, (self.x, self.y))
 
 class MainMenu(BaseControl):
     def  __init__(self, height=18, margin=5, spacing=0, color=COLOR_FOREGROUND, *args, **kwargs):
@@ -803,11 +1184,13 @@ class MainMenu(BaseControl):
         self._controls = HorizontalLayout(spacing=self._spacing)
         self._controls._set_parent(self)
         super().__init__(0, 0, 8, height, color, **kwargs)
+        self._controls._set_owner(self)
         self._drop_shadow = False
         self._menus = {}
         self._controls.x = self.x+margin
         self._controls.y = self.y+margin
         self._selected_menu = None
+        self._menu_color = darker(COLOR_FOREGROUND, 0.1)
         self._on_menu_item_cb = None
         self._selectable = True
 
@@ -886,14 +1269,12 @@ class MainMenu(BaseControl):
         return self._width
 
     def draw(self, surf):
-        draw_panel(surf, self.x, self.y, self.width, self.height, self._color)        
+        draw_panel_cached(surf, self.x, self.y, self.width, self.height, self._color, theme=self._theme)        
         for menu in self._menus.values():
             if menu is self._selected_menu:
                 layout = menu["layout"]
-                draw_panel(surf, layout.x-4, layout.y+self.height, layout.width+4*2, layout.height-self.height, darker(COLOR_FOREGROUND, 0.1))
-                highlight = pygame.Surface((menu["label"].width, self.height-2))
-                highlight.fill((35,45,37))
-                surf.blit(highlight, (menu["label"].x, self.y+2), special_flags=pygame.BLEND_RGB_ADD)
+                draw_panel_cached(surf, layout.x-4, layout.y+self.height, layout.width+4*2, layout.height-self.height, self._menu_color, theme=self._theme)
+                surf.fill((35,45,37), (menu["label"].x, self.y+2, menu["label"].width, self.height-2), special_flags=pygame.BLEND_RGB_ADD)
 
 class ColorCell(BaseControl):
     def  __init__(self, width, height, color, *args, **kwargs):
@@ -906,14 +1287,15 @@ class ColorCell(BaseControl):
         return self._color
 
     @color.setter
+    @makes_dirty
     def color(self, color):
         if isinstance(color, pygame.Color):
             color = (color.r, color.g, color.b)
         self._color = color
 
-    def draw(self, surf):
-        pygame.draw.rect(surf, self._color, (self.x, self.y, self.width, self.height))
-        pygame.draw.rect(surf, self._border_color, (self.x, self.y, self.width, self.height), width=1)
+    def render(self, surf, x, y):
+        pygame.draw.rect(surf, self._color, (x, y, self.width, self.height))
+        pygame.draw.rect(surf, self._border_color, (x, y, self.width, self.height), width=1)
 
 class ROI(BaseControl):
     (DRAG_MODE_V1,
@@ -924,11 +1306,14 @@ class ROI(BaseControl):
     DRAG_MODE_E2, 
     DRAG_MODE_E3, 
     DRAG_MODE_E4) = range(1, 9)
+    ANTS = MarchingAnts() # shared by all ROIs
 
-    def  __init__(self, width, height, *args, **kwargs):
+    def  __init__(self, width, height, ants_speed=0, *args, **kwargs):
         super().__init__(0, 0, width, height, *args, **kwargs)
         self._drop_shadow = False
+        self._ants_speed = ants_speed # pixels per second, 0 - static outline
         self._controls = Layout(self.x, self.y)
+        self._controls._set_owner(self)
         self._label = self._controls.add(Label(""))      
         self._label.x += 5
         self._label.y += 5
@@ -1000,25 +1385,25 @@ class ROI(BaseControl):
     @Region.x.getter
     @load_from_conf
     def x(self):    
-        return self._x
+        return self._abs_pos()[0]
 
     @x.setter
     @makes_dirty
     @save_to_conf
     def x(self, val):        
-        self._x = val
+        self._set_x(val)
         self._controls.x = val          
 
     @Region.y.getter
     @load_from_conf 
     def y(self):
-        return self._y        
+        return self._abs_pos()[1]
 
     @y.setter
     @makes_dirty
     @save_to_conf
     def y(self, val):
-        self._y = val
+        self._set_y(val)
         self._controls.y = val   
 
     @Region.width.getter
@@ -1046,38 +1431,264 @@ class ROI(BaseControl):
     def set_text(self, s):
         self._label.text = s
 
+    @property
+    def ants_speed(self):
+        return self._ants_speed
+
+    @ants_speed.setter
+    def ants_speed(self, speed):
+        self._ants_speed = speed
+
     def _redraw(self):
         if self.name is not None and not self._label._visible:
             self._label.text = self.name
             self._label._visible = True
-        self._surface =pygame.Surface((self.width,self.height)).convert()
-        self._surface.set_colorkey(self._surface.get_at((0,0)))
-        line_length =2
-        h = self.height-1
-        w = self.width-1
-        for x in range(0, self.width, line_length+2):
-            pygame.draw.line(self._surface, (245, 233, 246), (x, 0), (x+line_length, 0))
-            pygame.draw.line(self._surface, (245, 233, 246), (x, h), (x+line_length, h))
-        for y in range(0, self.height, line_length+2):
-            pygame.draw.line(self._surface, (245, 233, 246), (0, y), (0, y+line_length))
-            pygame.draw.line(self._surface, (245, 233, 246), (w, y), (w, y+line_length))
-
         self._dirty = False         
     
     def draw(self, surf):
         if self._dirty:
             self._redraw()
-        surf.blit(self._surface, (self.x, self.y), special_flags=pygame.BLEND_ADD)
-        pygame.draw.rect(surf, (245,234,255), (self.x-1, self.y-1, 4,4),width=1)
-        pygame.draw.rect(surf, (245,234,255), (self.right-2, self.y-1, 4,4),width=1)
-        pygame.draw.rect(surf, (245,234,255), (self.right-2, self.bottom-2, 4,4),width=1)
-        pygame.draw.rect(surf, (245,234,255), (self.x-1, self.bottom-2, 4,4),width=1)
+        x, y, width, height = self.roi
+        right = x + width
+        bottom = y + height
+        phase = self.get_ticks() * self._ants_speed // 1000 if self._ants_speed else 0
+        self.ANTS.draw(surf, x, y, width, height, phase)
+        pygame.draw.rect(surf, (245,234,255), (x-1, y-1, 4,4),width=1)
+        pygame.draw.rect(surf, (245,234,255), (right-2, y-1, 4,4),width=1)
+        pygame.draw.rect(surf, (245,234,255), (right-2, bottom-2, 4,4),width=1)
+        pygame.draw.rect(surf, (245,234,255), (x-1, bottom-2, 4,4),width=1)
+
+class ROICollection(BaseControl):
+    """ many ROIs over one image, stored as arrays and hit-tested through a grid index
+        ROI coordinates are relative to the control (i.e. image coordinates),
+        vertices and edges are dragged the same way as with ROI
+    """
+    INDEX_CELL = 64
+    PICK_SIZE = 3
+
+    def  __init__(self, width, height, *args, **kwargs):
+        super().__init__(0, 0, width, height, *args, **kwargs)
+        self._drop_shadow = False
+        self._rects = np.zeros((0, 4), dtype=np.int32) # x, y, width, height
+        self._names = []
+        self._index = None # (cell_x, cell_y) -> array of roi indices
+        self._ants_speed = 0
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def rects(self):
+        return self._rects.copy()
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    @property
+    def ants_speed(self):
+        return self._ants_speed
+
+    @ants_speed.setter
+    def ants_speed(self, speed):
+        self._ants_speed = speed
+
+    def add_roi(self, x, y, width, height, name=None):
+        self._rects = np.vstack((self._rects, np.array([[x, y, width, height]], dtype=np.int32)))
+        self._names.append(name if name is not None else "roi%d" % len(self._names))
+        self._index = None
+        return len(self._names) - 1
+
+    def add_rois(self, rects, names=None):
+        rects = np.asarray(rects, dtype=np.int32).reshape(-1, 4)
+        if names is None:
+            names = ["roi%d" % i for i in range(len(self._names), len(self._names)+len(rects))]
+        if len(names)!=len(rects):
+            raise ValueError("names and rects should have the same length")
+        self._rects = np.vstack((self._rects, rects))
+        self._names.extend(names)
+        self._index = None
+
+    def remove_roi(self, idx):
+        self._rects = np.delete(self._rects, idx, axis=0)
+        del self._names[idx]
+        self._index = None
+
+    def clear(self):
+        self._rects = np.zeros((0, 4), dtype=np.int32)
+        self._names = []
+        self._index = None
+
+    def get_roi(self, idx):
+        return tuple(int(v) for v in self._rects[idx])
+
+    def _build_index(self):
+        cell = self.INDEX_CELL
+        size = self.PICK_SIZE
+        x1 = (self._rects[:, 0] - size) // cell
+        y1 = (self._rects[:, 1] - size) // cell
+        x2 = (self._rects[:, 0] + self._rects[:, 2] + size) // cell
+        y2 = (self._rects[:, 1] + self._rects[:, 3] + size) // cell
+        buckets = {}
+        for i, (c_x1, c_y1, c_x2, c_y2) in enumerate(zip(x1.tolist(), y1.tolist(), x2.tolist(), y2.tolist())):
+            for c_y in range(c_y1, c_y2+1):
+                for c_x in range(c_x1, c_x2+1):
+                    buckets.setdefault((c_x, c_y), []).append(i)
+        self._index = {key: np.array(val, dtype=np.intp) for key, val in buckets.items()}
+
+    def candidates(self, x, y):
+        """ indices of ROIs that may be under image point x, y """
+        if self._index is None:
+            self._build_index()
+        return self._index.get((x // self.INDEX_CELL, y // self.INDEX_CELL), np.zeros(0, dtype=np.intp))
+
+    def pick(self, x, y):
+        """ find the topmost ROI whose vertex or edge is at image point x, y
+            returns (index, ROI.DRAG_MODE_*) or None
+        """
+        idx = self.candidates(x, y)
+        if not len(idx):
+            return None
+        size = self.PICK_SIZE
+        r_x, r_y, r_w, r_h = self._rects[idx].T
+        right = r_x + r_w
+        bottom = r_y + r_h
+        near_l = abs(x - r_x) <= size
+        near_r = abs(x - right) <= size
+        near_t = abs(y - r_y) <= size
+        near_b = abs(y - bottom) <= size
+        in_h = (x >= r_x) & (x <= right)
+        in_v = (y >= r_y) & (y <= bottom)
+        modes = np.select([near_l & near_t, near_r & near_t, near_r & near_b, near_l & near_b,
+                           in_h & near_t, in_h & near_b, in_v & near_l, in_v & near_r],
+                          [ROI.DRAG_MODE_V1, ROI.DRAG_MODE_V2, ROI.DRAG_MODE_V3, ROI.DRAG_MODE_V4,
+                           ROI.DRAG_MODE_E1, ROI.DRAG_MODE_E3, ROI.DRAG_MODE_E4, ROI.DRAG_MODE_E2], 0)
+        hits = np.nonzero(modes)[0]
+        if not len(hits):
+            return None
+        top = hits[np.argmax(idx[hits])]
+        return int(idx[top]), int(modes[top])
+
+    def rois_at(self, x, y):
+        """ indices of all ROIs containing image point x, y """
+        idx = self.candidates(x, y)
+        r_x, r_y, r_w, r_h = self._rects[idx].T
+        return idx[(x >= r_x) & (y >= r_y) & (x <= r_x + r_w) & (y <= r_y + r_h)]
+
+    def drag_test(self, x, y):
+        return self.pick(x - self.x, y - self.y)
+
+    def drag_move(self, mode, x, y, x_rel, y_rel, app, button):
+        super().drag_move(mode, x, y, x_rel, y_rel, app, button)
+        if button!=pygame.BUTTON_LEFT:
+            return
+        idx, mode = mode
+        r_x, r_y, r_w, r_h = self.get_roi(idx)
+        x -= self.x
+        y -= self.y
+        if mode==ROI.DRAG_MODE_V1:
+            r_x, r_y, r_w, r_h = x, y, r_w - x_rel, r_h - y_rel
+        elif mode==ROI.DRAG_MODE_V2:
+            r_y, r_w, r_h = y, r_w + x_rel, r_h - y_rel
+        elif mode==ROI.DRAG_MODE_V3:
+            r_w, r_h = r_w + x_rel, r_h + y_rel
+        elif mode==ROI.DRAG_MODE_V4:
+            r_x, r_w, r_h = x, r_w - x_rel, r_h + y_rel
+        else:
+            r_x, r_y = r_x + x_rel, r_y + y_rel
+        if r_w<=0:
+            r_x += r_w
+            r_w = 1
+        if r_h<=0:
+            r_y += r_h
+            r_h = 1
+        self._rects[idx] = r_x, r_y, r_w, r_h
+        self._index = None
+
+    def render(self, surf, x, y):
+        if not len(self._names):
+            return
+        clip = surf.get_clip()
+        rects = self._rects
+        visible = ((rects[:, 0] + x <= clip.right) & (rects[:, 1] + y <= clip.bottom) &
+                   (rects[:, 0] + rects[:, 2] + x >= clip.x) & (rects[:, 1] + rects[:, 3] + y >= clip.y))
+        phase = self.get_ticks() * self._ants_speed // 1000 if self._ants_speed else 0
+        ants = ROI.ANTS
+        for r_x, r_y, r_w, r_h in (rects[visible] + (x, y, 0, 0)).tolist():
+            right = r_x + r_w
+            bottom = r_y + r_h
+            ants.draw(surf, r_x, r_y, r_w, r_h, phase)
+            pygame.draw.rect(surf, (245,234,255), (r_x-1, r_y-1, 4,4),width=1)
+            pygame.draw.rect(surf, (245,234,255), (right-2, r_y-1, 4,4),width=1)
+            pygame.draw.rect(surf, (245,234,255), (right-2, bottom-2, 4,4),width=1)
+            pygame.draw.rect(surf, (245,234,255), (r_x-1, bottom-2, 4,4),width=1)
+
+    def export_json(self, filename):
+        data = [dict(name=name, x=r_x, y=r_y, width=r_w, height=r_h)
+                for name, (r_x, r_y, r_w, r_h) in zip(self._names, self._rects.tolist())]
+        with open(filename, "w") as f:
+            json.dump(data, f, indent=1)
+
+    def import_json(self, filename):
+        with open(filename, "r") as f:
+            data = json.load(f)
+        self.add_rois([(item["x"], item["y"], item["width"], item["height"]) for item in data],
+                      [item.get("name", "roi%d" % (len(self._names)+i)) for i, item in enumerate(data)])
+
+    def export_csv(self, filename):
+        with open(filename, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("name", "x", "y", "width", "height"))
+            for name, rect in zip(self._names, self._rects.tolist()):
+                writer.writerow((name, *rect))
+
+    def import_csv(self, filename):
+        with open(filename, "r", newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.add_rois([(int(row["x"]), int(row["y"]), int(row["width"]), int(row["height"])) for row in rows],
+                      [row["name"] for row in rows])
+
+    def crop_all(self, surf, out_dir, ext=".png", workers=None):
+        """ save every ROI of surf (the image under this control) to out_dir/<name><ext>
+            crops are copied here, encoding and writing happens on a thread pool
+            returns the list of written file names
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        bounds = surf.get_rect()
+        jobs = []
+        used = set()
+        for idx, (name, rect) in enumerate(zip(self._names, self._rects.tolist())):
+            rect = bounds.clip(rect)
+            if rect.width<1 or rect.height<1:
+                continue
+            fn = self._safe_filename(name, idx, used)
+            jobs.append((surf.subsurface(rect).copy(), os.path.join(out_dir, fn + ext)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda job: pygame.image.save(*job), jobs))
+        return [filename for _, filename in jobs]
+
+    @staticmethod
+    def _safe_filename(name, idx, used):
+        """ file name for an imported ROI name: no directories, only
+            filename-safe characters, unique (case insensitive) within used
+        """
+        name = os.path.basename(str(name).replace("\\", "/"))
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name).lstrip(".")
+        if not name:
+            name = "roi"
+        fn = name
+        while fn.lower() in used:
+            fn = "%s_%d" % (name, idx)
+            idx += 1
+        used.add(fn.lower())
+        return fn
 
 class ButtonCtrl(BaseControl):
     def  __init__(self, label, width, height, color=COLOR_FOREGROUND, font_color=COLOR_WHITE, btn_image=None, *args, **kwargs):
         super().__init__(0, 0, width, height, color, *args, **kwargs)
         self._label_txt = label
         self._controls = Layout(self.x, self.y)
+        self._controls._set_owner(self)
         self._label_ctrl = self._controls.add( Label(self._label_txt, shaded=True, max_width=width-4, font_color=font_color) )
         self._label_ctrl.x = self.x + (width - self._label_ctrl.width)//2
         self._label_ctrl.y = self.y + (height - self._label_ctrl.height)//2
@@ -1095,6 +1706,7 @@ class ButtonCtrl(BaseControl):
         self._pushed_cb = types.MethodType(f_cb, self)
     on_pushed = property(fset=on_pushed)   
 
+    @makes_dirty
     def set_highlighted(self, highlighted):
         self._is_highlighted = highlighted
 
@@ -1103,18 +1715,19 @@ class ButtonCtrl(BaseControl):
         return self._btn_image
 
     @btn_image.setter
+    @makes_dirty
     def btn_image(self, surf):
         self._btn_image = surf
 
     @BaseControl.x.setter
     def x(self, val):
-        self._x = val
-        self._controls.x  = self._x        
+        self._set_x(val)
+        self._controls.x  = val
 
     @BaseControl.y.setter
     def y(self, val):
-        self._y = val        
-        self._controls.y  = self._y
+        self._set_y(val)
+        self._controls.y  = val
 
     @property
     def is_pushed(self):
@@ -1126,6 +1739,7 @@ class ButtonCtrl(BaseControl):
         self._label_ctrl.x = self.x + (self.width - self._label_ctrl.width)//2
 
     @is_pushed.setter
+    @makes_dirty
     def is_pushed(self, value):
         self._is_pushed = int(value)
         if self._is_pushed!=0:
@@ -1139,18 +1753,15 @@ class ButtonCtrl(BaseControl):
         if self._pushed_cb is not None:
             self._pushed_cb()        
             
-    def draw(self, surf):        
-        pygame.draw.rect(surf, self._panel_color, (self.x, self.y, self.width, self.height))
-        draw_shaded_frame(surf, self._x, self._y, self.width, self.height, self._shade_color, self._light_color, mode=self._is_pushed)
+    def render(self, surf, x, y):        
+        draw_panel_cached(surf, x, y, self.width, self.height, self._panel_color, self._shade_color, self._light_color, mode=self._is_pushed)
         if self._btn_image is not None:
             img_size_x, img_size_y = self._btn_image.get_size()
-            im_x = self._x + (self.width - img_size_x) // 2
-            im_y = self._y + (self.height - img_size_y) // 2
+            im_x = x + (self.width - img_size_x) // 2
+            im_y = y + (self.height - img_size_y) // 2
             surf.blit(self._btn_image, (im_x, im_y + self._is_pushed ) )
         if self._is_highlighted:            
-            highlight = pygame.Surface((self.width, self.height)).convert()
-            highlight.fill((25, 23, 19))
-            surf.blit(highlight, (self.x, self.y), special_flags=pygame.BLEND_ADD )
+            surf.fill((25, 23, 19), (x, y, self.width, self.height), special_flags=pygame.BLEND_ADD)
 
 class Undoable():
     UNDO_SIZE = 5
@@ -1200,8 +1811,10 @@ class SliderCtrl(BaseControl):
         self._old_slider_pos = 0
         self.set_range(*value_range)
 
-    def _slider_rect(self):
-        return (self.x + 1 + self.pos, self.y + 1, 5, self.height - 2)
+    def _slider_rect(self, x=None, y=None):
+        if x is None:
+            x, y = self.x, self.y
+        return (x + 1 + self.pos, y + 1, 5, self.height - 2)
 
     def set_range(self, n1, n2):
         if n1>n2:
@@ -1241,6 +1854,7 @@ class SliderCtrl(BaseControl):
         return self._slider_pos
 
     @pos.setter
+    @makes_dirty
     @save_to_conf
     def pos(self, value):
         self._slider_pos = value
@@ -1254,35 +1868,37 @@ class SliderCtrl(BaseControl):
         value = ((v_range * self.pos) / (self.width-self._slider_rect()[2])) + self._min
         return value
     
-    def draw(self, surf):
-        pygame.draw.rect(surf, self._color, (self.x, self.y, self.width, self.height))
-        draw_shaded_frame(surf, self.x, self.y, self.width, self.height, darker(self.color, 0.3), brighter(self.color, 0.2))
-        draw_shaded_frame(surf, self.x+3, self.y+2, self.width-6, 5, darker(self.color, 0.3), brighter(self.color, 0.2), mode=1)
+    def render(self, surf, x, y):
+        palette = self.palette
+        pygame.draw.rect(surf, self._color, (x, y, self.width, self.height))
+        draw_shaded_frame(surf, x, y, self.width, self.height, palette.shade, palette.light)
+        draw_shaded_frame(surf, x+3, y+2, self.width-6, 5, palette.shade, palette.light, mode=1)
 
-        slider_rect = self._slider_rect()
+        slider_rect = self._slider_rect(x, y)
 
         pygame.draw.rect(surf, self._color, slider_rect)
-        draw_shaded_frame(surf, *slider_rect, darker(self.color, 0.3), brighter(self.color, 0.2))
+        draw_shaded_frame(surf, *slider_rect, palette.shade, palette.light)
 
 class VerticalLine(BaseControl):
     def  __init__(self, length, thickness=3, color=COLOR_FOREGROUND, mode=0, *args, **kwargs):                        
         super().__init__(0, 0, thickness, length, color, *args, **kwargs)
         self._mode = mode
-        self._shade_color = darker(self._color, SHADE_TINT)     
-        self._light_color = brighter(self._color, LIGHT_TINT)
 
     @Region.height.setter
     def height(self, height):
         self._height = height
 
-    def draw(self, surf):
-        draw_panel(surf, self.x, self.y, self.width, self.height, self._color,  self._shade_color, self._light_color, self._mode )
+    def render(self, surf, x, y):
+        palette = self.palette
+        draw_panel(surf, x, y, self.width, self.height, self._color,  palette.shade, palette.light, self._mode, theme=self._theme)
 
 class SpriteSheetCtrl(Undoable, BaseControl, BaseGrid):
     """ render a sprite sheet (for preview) """    
-    def  __init__(self, sprite_size, cols, rows, *args, **kwargs):
+    def  __init__(self, sprite_size, cols, rows, *args, palette=None, **kwargs):
         super().__init__(0, 0, 0, 0, COLOR_DEFAULT, cols=cols, rows=rows, *args, **kwargs)
         self._sprite_size = sprite_size        
+        self._image_palette = palette # indexed 8-bit sheet if set
+        self._sprite_rects = [] # sprite bounds found by set_image
         self._border_color = COLOR_BORDER
         self.select_region(0)
         self._zoom_factor = 1
@@ -1294,8 +1910,13 @@ class SpriteSheetCtrl(Undoable, BaseControl, BaseGrid):
     def _new_image(self, keep_contents=False):
         if keep_contents:
             old_image = self._image
-        self._image = pygame.Surface((self.width, self.height))
-        self._image = self._image.convert()
+        if self._image_palette is not None:
+            self._image = pygame.Surface((self.width, self.height), 0, 8)
+            self._image.set_palette(self._image_palette)
+            self._image_palette = [tuple(c)[:3] for c in self._image.get_palette()]
+        else:
+            self._image = pygame.Surface((self.width, self.height))
+            self._image = self._image.convert()
         self._image.fill(self._color)
         if keep_contents:
             self._image.blit(old_image, (0, 0))
@@ -1323,9 +1944,9 @@ class SpriteSheetCtrl(Undoable, BaseControl, BaseGrid):
         self._rows = self._rows + 1
         self._new_image(True)                 
             
-    @Undoable.clears_undo
-    def set_image(self, image):
-        size_x, size_y = image.get_size()
+    @staticmethod
+    def _guess_sprite_size(size_x, size_y):
+        """ largest power of two cell (<= 128) the image divides into """
         sprite_size_x = 128
         sprite_size_y = 128
         while True:
@@ -1346,16 +1967,76 @@ class SpriteSheetCtrl(Undoable, BaseControl, BaseGrid):
             size_x = size_x + (size_x % sprite_size_x)
         if sprite_size_y < 8:
             size_y = size_y + (size_y % sprite_size_y)            
+        return (sprite_size_x, sprite_size_y), size_x, size_y
 
-        self._sprite_size = (sprite_size_x, sprite_size_y)
+    @Undoable.clears_undo
+    def set_image(self, image):
+        """ load a sheet, the sprite size is taken from the grid the sprites
+            sit on (see detect_grid_pitch), sprite bounds end up in sprite_rects
+        """
+        size_x, size_y = image.get_size()
+        mask = opaque_mask(image)
+        self._sprite_rects = find_sprite_rects(image, mask=mask)
+        pitch = detect_grid_pitch(image, rects=self._sprite_rects, mask=mask) if len(self._sprite_rects) > 1 else None
+        if pitch is not None:
+            sprite_size = pitch
+            size_x = -(-size_x // pitch[0]) * pitch[0]
+            size_y = -(-size_y // pitch[1]) * pitch[1]
+        else:
+            sprite_size, size_x, size_y = self._guess_sprite_size(size_x, size_y)
+
+        self._sprite_size = sprite_size
         self._cols = size_x // self._sprite_size[0]
         self._rows = size_y // self._sprite_size[1]
 
+        if is_indexed(image):
+            self._image_palette = [tuple(c)[:3] for c in image.get_palette()]
         self._new_image()
         self._image.blit( image, (0, 0) )
         #print('image.get_size():', image.get_size(), 'size_x:', size_x, 'size_y:', size_y)        
         self.select_region(0)
 
+    def dedupe_tiles(self, variants=True):
+        """ TileSet of the sheet cells, see TileSet.save to export a compacted sheet """
+        return TileSet.from_surface(self._image, self._sprite_size, variants)
+
+    @property
+    def sprite_rects(self):
+        """ bounding rects of the sprites found by set_image """
+        return self._sprite_rects
+
+    def cell_sprite_rects(self):
+        """ {cell index: sprite bounds} for the sprites inside a grid cell """
+        sprite_w, sprite_h = self._sprite_size
+        res = {}
+        for rect in self._sprite_rects:
+            col, row = rect.x // sprite_w, rect.y // sprite_h
+            if col < self._cols and row < self._rows:
+                idx = row * self._cols + col
+                res[idx] = res[idx].union(rect) if idx in res else rect
+        return res
+
+    @property
+    def is_indexed(self):
+        return is_indexed(self._image)
+
+    @property
+    def image_palette(self):
+        return self._image_palette
+
+    @Undoable.clears_undo
+    def make_indexed(self, palette=None):
+        """ switch the sheet to 8-bit palette indices, see to_indexed """
+        self._image = to_indexed(self._image, palette)
+        self._image_palette = [tuple(c)[:3] for c in self._image.get_palette()]
+
+    def set_palette_color(self, index, color):
+        """ recolor the whole sheet by editing its palette """
+        if not self.is_indexed:
+            raise ValueError('sprite sheet is not indexed')
+        self._image.set_palette_at(index, color)
+        self._image_palette[index] = tuple(pygame.Color(color))[:3]
+
     @property
     def region_x(self):
         return self._region_col * self._sprite_size[0]
@@ -1422,8 +2103,8 @@ class SpriteSheetCtrl(Undoable, BaseControl, BaseGrid):
         
     def draw(self, surf):        
         surf.blit(self.image, (self.x, self.y))
-        pygame.draw.rect(surf, brighter( self._color, 0.5 ), (self.x-1, self.y-1, self.width+1, self.height+1), width=1)
-        pygame.draw.rect(surf, brighter( self._color, 0.3 ), (self.region_x + self.x-1, self.region_y+self.y-1, self._sprite_size[0]+2, self._sprite_size[1]+2), width=1)
+        pygame.draw.rect(surf, self.palette.brighter(0.5), (self.x-1, self.y-1, self.width+1, self.height+1), width=1)
+        pygame.draw.rect(surf, self.palette.brighter(0.3), (self.region_x + self.x-1, self.region_y+self.y-1, self._sprite_size[0]+2, self._sprite_size[1]+2), width=1)
 
 class TextEntry(BaseControl):
     typable_chars = "abcdefghijkhklmnopqrstquwxyz1234567890+-!#$%^*()~:;?,. "
@@ -1435,6 +2116,7 @@ class TextEntry(BaseControl):
         self._controls = Layout()
         self._controls._set_parent(self)
         super().__init__(0, 0, width, 12, color,  *args, **kwargs)
+        self._controls._set_owner(self)
         self._controls.x = self.x
         self._controls.y = self.y
         self._lbl_text = self._controls.add( Label(text, max_width=width, **kwargs) )
@@ -1444,6 +2126,7 @@ class TextEntry(BaseControl):
         self._selectable = True
         self._editable = True
         self._drop_shadow = False
+        self._cursor_on = False
 
     @property
     def text(self):
@@ -1470,28 +2153,38 @@ class TextEntry(BaseControl):
             self._lbl_text.text = self._lbl_text.text + key_s
         super().key_pressed(key, app)
     
+    def _retained_key(self):
+        return (self.width, self.height, self._lbl_text.right - self.x, self._lbl_text.height)
+
     def draw(self, surf):
-        draw_panel(surf, self._x, self._y, self.width, self.height, self._color, mode=3)
-        if self._selected and (pygame.time.get_ticks()//350)%2:
-            cursor_pos_x = min(self._lbl_text.right+1, self.right-self._border)
-            pygame.draw.rect(surf, self._color, (cursor_pos_x, self.y+self._border , 2,  self._lbl_text.height) )
+        cursor_on = bool(self._selected and (self.get_ticks()//350)%2)
+        if cursor_on!=self._cursor_on:
+            self._cursor_on = cursor_on
+            self._dirty = True
+        super().draw(surf)
+
+    def render(self, surf, x, y):
+        draw_panel(surf, x, y, self.width, self.height, self._color, mode=3, theme=self._theme)
+        if self._cursor_on:
+            cursor_pos_x = min(self._lbl_text.right+1, self.right-self._border) - self.x + x
+            pygame.draw.rect(surf, self._color, (cursor_pos_x, y+self._border , 2,  self._lbl_text.height) )
 
     @Region.y.getter
     def y(self):
-        return self._y
+        return self._abs_pos()[1]
 
     @y.setter
     def y(self, val):
-        self._y = val
+        self._set_y(val)
         self._controls.y = val
 
     @Region.x.getter
     def x(self):
-        return self._x
+        return self._abs_pos()[0]
 
     @x.setter
     def x(self, val):
-        self._x = val        
+        self._set_x(val)
         self._controls.x = val
 
 class SpritePreview(BaseControl):
@@ -1569,6 +2262,296 @@ class SpritePreview(BaseControl):
     def draw(self, surf):
         surf.blit(self.image, (self.x, self.y))
 
+class ListView(BaseControl):
+    """ Scrollable list over a data source, only the rows in view exist as controls
+        data is a sequence, or a callable(index) together with count (int or callable)
+        rows are made by make_row(list_view) and recycled through
+        bind_row(row, item, index) while scrolling, so a list of 100k items
+        costs the same per frame as a list of 20
+    """
+    DRAG_MODE_SCROLL = 1
+    SCROLLBAR_WIDTH = 8
+    WHEEL_ROWS = 3
+    def __init__(self, width=160, height=120, data=(), count=None, row_height=10, cols=1, make_row=None, bind_row=None,
+                 font_color=COLOR_WHITE, selection_color=COLOR_FILE_SELECTION, background=True, color=COLOR_FOREGROUND, *args, **kwargs):
+        super().__init__(0, 0, width, height, color, *args, **kwargs)
+        self._drop_shadow = False
+        self._selectable = True
+        self._border = 2
+        self._row_height = row_height
+        self._cols = cols
+        self._font_color = font_color
+        self._selection_color = selection_color
+        self._background = background
+        self._make_row = self._make_label if make_row is None else make_row
+        self._bind_row = self._bind_label if bind_row is None else bind_row
+        self._data = data
+        self._count = count
+        self._synced_count = None
+        self._top = 0
+        self._selected_index = None
+        self._bound = {} # data index -> row control
+        self._free = [] # recycled rows
+        self._grab_offset = 0
+        self._on_select_cb = None
+        self._on_activate_cb = None
+        self._controls = Layout(self.x, self.y)
+        self._controls._set_parent(self)
+        self._controls._set_owner(self)
+        self._sync_rows()
+
+    def _make_label(self, list_view):
+        return Label("", max_width=self.cell_width, font_color=self._font_color)
+
+    @staticmethod
+    def _bind_label(row, item, index):
+        row.text = str(item)
+
+    def on_select(self, f_cb):
+        """ f(index, item, app), the selection changed by mouse or keyboard """
+        self._on_select_cb = types.MethodType(f_cb, self)
+    on_select = property(fset=on_select)
+
+    def on_activate(self, f_cb):
+        """ f(index, item, app), an item was double clicked or confirmed by Return """
+        self._on_activate_cb = types.MethodType(f_cb, self)
+    on_activate = property(fset=on_activate)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def count(self):
+        if self._count is None:
+            return len(self._data)
+        if callable(self._count):
+            return self._count()
+        return self._count
+
+    def item(self, index):
+        if callable(self._data):
+            return self._data(index)
+        return self._data[index]
+
+    @makes_dirty
+    def set_data(self, data, count=None):
+        """ replace the data source, keeps the scroll position if possible """
+        self._data = data
+        self._count = count
+        if self._selected_index is not None and self._selected_index >= self.count:
+            self._selected_index = None
+        self.refresh()
+
+    def refresh(self):
+        """ rebind the visible rows, call it after changing the data in place """
+        self._top = max(0, min(self._top, self.max_top_row))
+        self._sync_rows(rebind=True)
+
+    @property
+    def cols(self):
+        return self._cols
+
+    @property
+    def row_height(self):
+        return self._row_height
+
+    @property
+    def cell_width(self):
+        return (self.width - self._border*2 - self.SCROLLBAR_WIDTH) // self._cols
+
+    @property
+    def visible_rows(self):
+        return max(1, (self.height - self._border*2) // self._row_height)
+
+    @property
+    def row_count(self):
+        return -(-self.count // self._cols)
+
+    @property
+    def max_top_row(self):
+        return max(0, self.row_count - self.visible_rows)
+
+    @property
+    def top_row(self):
+        return self._top
+
+    @top_row.setter
+    @makes_dirty
+    def top_row(self, row):
+        row = max(0, min(row, self.max_top_row))
+        if row != self._top:
+            self._top = row
+            self._sync_rows()
+
+    def scroll(self, rows):
+        self.top_row = self._top + rows
+
+    def ensure_visible(self, index):
+        row = index // self._cols
+        if row < self._top:
+            self.top_row = row
+        elif row >= self._top + self.visible_rows:
+            self.top_row = row - self.visible_rows + 1
+
+    @property
+    def selected_index(self):
+        return self._selected_index
+
+    @selected_index.setter
+    @makes_dirty
+    def selected_index(self, index):
+        if index is not None:
+            if self.count:
+                index = max(0, min(index, self.count-1))
+                self.ensure_visible(index)
+            else:
+                index = None
+        self._selected_index = index
+
+    @property
+    def selected_item(self):
+        if self._selected_index is None:
+            return None
+        return self.item(self._selected_index)
+
+    def row_control(self, index):
+        """ the control currently showing index, None if it's scrolled out """
+        return self._bound.get(index)
+
+    def index_at_pos(self, x, y):
+        col = (x - self.x - self._border) // self.cell_width
+        row = (y - self.y - self._border) // self._row_height
+        if col < 0 or col >= self._cols or row < 0 or row >= self.visible_rows:
+            return None
+        index = (self._top + row) * self._cols + col
+        return index if index < self.count else None
+
+    def _sync_rows(self, rebind=False):
+        """ bind the rows in view, rows that went out of view are reused first """
+        count = self.count
+        first = self._top * self._cols
+        last = min(count, first + self.visible_rows * self._cols)
+        for index in [index for index in self._bound if index < first or index >= last]:
+            row = self._bound.pop(index)
+            row._visible = False
+            self._free.append(row)
+
+        cell_width = self.cell_width
+        for index in range(first, last):
+            row = self._bound.get(index)
+            if row is None:
+                row = self._free.pop() if self._free else self._controls.add(self._make_row(self))
+                self._bound[index] = row
+                self._bind_row(row, self.item(index), index)
+            elif rebind:
+                self._bind_row(row, self.item(index), index)
+            row._visible = True
+            cell_row, cell_col = divmod(index - first, self._cols)
+            row.x = self.x + self._border + cell_col * cell_width
+            row.y = self.y + self._border + cell_row * self._row_height + (self._row_height - row.height)//2
+        self._synced_count = count
+
+    def _select(self, index, app):
+        if index != self._selected_index:
+            self.selected_index = index
+            if self._on_select_cb is not None and index is not None:
+                self._on_select_cb(index, self.item(index), app)
+
+    def _activate(self, app):
+        if self._on_activate_cb is not None and self._selected_index is not None:
+            self._on_activate_cb(self._selected_index, self.selected_item, app)
+
+    def clicked(self, click_x, click_y, button, app):
+        if button==pygame.BUTTON_WHEELUP:
+            self.scroll(-self.WHEEL_ROWS)
+        elif button==pygame.BUTTON_WHEELDOWN:
+            self.scroll(self.WHEEL_ROWS)
+        elif button==pygame.BUTTON_LEFT:
+            index = self.index_at_pos(click_x, click_y)
+            if index is not None:
+                self._select(index, app)
+        return super().clicked(click_x, click_y, button, app)
+
+    def doubleclicked(self, click_x, click_y, button, app):
+        if button==pygame.BUTTON_LEFT and self.index_at_pos(click_x, click_y) is not None:
+            self._activate(app)
+        return super().doubleclicked(click_x, click_y, button, app)
+
+    def key_pressed(self, key, app):
+        page = self.visible_rows * self._cols
+        steps = {pygame.K_UP: -self._cols, pygame.K_DOWN: self._cols, pygame.K_PAGEUP: -page, pygame.K_PAGEDOWN: page}
+        if self._cols > 1:
+            steps.update({pygame.K_LEFT: -1, pygame.K_RIGHT: 1})
+        if self.count:
+            if key in steps:
+                index = 0 if self._selected_index is None else self._selected_index + steps[key]
+                self._select(max(0, min(index, self.count-1)), app)
+            elif key==pygame.K_HOME:
+                self._select(0, app)
+            elif key==pygame.K_END:
+                self._select(self.count-1, app)
+            elif key==pygame.K_RETURN:
+                self._activate(app)
+        super().key_pressed(key, app)
+
+    def _scrollbar_rects(self, x=None, y=None):
+        """ (track, thumb) rects, thumb is None if everything fits """
+        if x is None:
+            x, y = self.x, self.y
+        track = (x + self.width - self._border - self.SCROLLBAR_WIDTH, y + self._border, self.SCROLLBAR_WIDTH, self.height - self._border*2)
+        max_top = self.max_top_row
+        if max_top == 0:
+            return track, None
+        thumb_h = max(6, track[3] * self.visible_rows // self.row_count)
+        thumb_y = track[1] + (track[3] - thumb_h) * self._top // max_top
+        return track, (track[0], thumb_y, track[2], thumb_h)
+
+    def drag_test(self, x, y):
+        track, thumb = self._scrollbar_rects()
+        if thumb is not None and self.pick_box(track[0], track[1], track[0]+track[2], track[1]+track[3], x, y):
+            if self.pick_box(thumb[0], thumb[1], thumb[0]+thumb[2], thumb[1]+thumb[3], x, y):
+                self._grab_offset = y - thumb[1]
+            else:
+                self._grab_offset = thumb[3] // 2
+            return self.DRAG_MODE_SCROLL
+        return None
+
+    def drag_move(self, mode, x, y, x_rel, y_rel, app, button):
+        super().drag_move(mode, x, y, x_rel, y_rel, app, button)
+        if mode==self.DRAG_MODE_SCROLL and button==pygame.BUTTON_LEFT:
+            track, thumb = self._scrollbar_rects()
+            if thumb is not None:
+                span = max(1, track[3] - thumb[3])
+                self.top_row = round((y - self._grab_offset - track[1]) * self.max_top_row / span)
+
+    def _retained_key(self):
+        return (self.width, self.height, self._top, self._selected_index, self.count)
+
+    def draw(self, surf):
+        if self.count != self._synced_count:
+            self.refresh()
+        super().draw(surf)
+
+    def render(self, surf, x, y):
+        palette = self.palette
+        if self._background:
+            draw_panel(surf, x, y, self.width, self.height, self._color, mode=3, theme=self._theme)
+        row = self._bound.get(self._selected_index)
+        if row is not None:
+            selection_rect = (row.x-self.x+x-1, row.y-self.y+y-1, row.width+2, row.height+2)
+            surf.fill(self._selection_color, selection_rect, special_flags=pygame.BLEND_RGB_SUB)
+
+        track, thumb = self._scrollbar_rects(x, y)
+        if thumb is not None:
+            draw_shaded_frame(surf, *track, palette.shade, palette.light, mode=1)
+            pygame.draw.rect(surf, self._color, thumb)
+            draw_shaded_frame(surf, *thumb, palette.shade, palette.light)
+
+class GridView(ListView):
+    """ ListView that fills cols cells per row, left to right """
+    def __init__(self, cols, width=300, height=120, data=(), count=None, cell_height=10, *args, **kwargs):
+        super().__init__(width, height, data, count, cell_height, cols, *args, **kwargs)
+
 class FileDialog(BaseControl):
     RESULT_OK, RESULT_CANCELLED = range(1,3)
     def __init__(self, dir_, title, width=600, height=250, filter_ext=(".png",), *args, **kwargs):
@@ -1579,13 +2562,14 @@ class FileDialog(BaseControl):
                 
         self._controls = Layout(self.x, self.y)
         self._controls._set_parent(self)
+        self._controls._set_owner(self)
         self._title_ctrl = self._controls.add(Label(title, shaded=True, max_width=self.width-10))
         self._title_ctrl.x = self.y + (self.width-self._title_ctrl.width)//2
         self._title_ctrl.y = self.y + 5
 
-        self._file_grid = self._controls.add(GridLayout(3, 15))
-        self._file_grid.x = self.x + 5
-        self._file_grid.y = self.y + 50        
+        self._file_grid = self._controls.add(GridView(3, width-5, height-(50+28+2+4), font_color=COLOR_FILE_VIEWER_FONT, background=False))
+        self._file_grid.x = self.x + 3
+        self._file_grid.y = self.y + 47
 
         self._btns_grid = self._controls.add(GridLayout(3, 1))
         self._btns_grid.y = self.y + self.height - 30          
@@ -1602,22 +2586,14 @@ class FileDialog(BaseControl):
         self._cancel_btn = self._btns_grid.add( ButtonCtrl("Cancel", 80, 25), (2, 0) )
         self._cancel_btn.on_click=self._cancel_clicked
         self._visible = False
-        self._selected_label = None
         self._on_result_cb = None
         self._result = None
 
-    def clicked(self, click_x, click_y, button, app):
-        for label in self._file_grid:
-            if label.click_test(click_x, click_y):
-                self._selected_label = label
-                break
-        super().clicked(click_x, click_y, button, app)
-
     def _ok_clicked(self, control, x, y, button, app):
         if button==pygame.BUTTON_LEFT:
             if self._on_result_cb is not None:
                 self._visible=False
-                self._on_result_cb(app, self._selected_label.text if self._selected_label is not None else None)
+                self._on_result_cb(app, self._file_grid.selected_item)
 
     def _cancel_clicked(self, control, x, y, button, app):
         if button==pygame.BUTTON_LEFT:
@@ -1637,56 +2613,34 @@ class FileDialog(BaseControl):
         self._files = os.listdir(os.path.dirname(__file__))        
         self._files = [fn for fn in self._files if os.path.splitext(fn)[1] in self._filter_ext]
 
-        #print('self._files:', self._files)
-
-        colums = self._file_grid.cols   
-        rows = self._file_grid.rows
-        col=0
-        row=0
-        files = [".."] + self._files    
-
-        #print('len(self._file_grid):', len(self._file_grid))
-
-        for i in range(self._file_grid.cell_count):      
-            if i >= (len(files)):
-                break
-            fn = files[i]
-            if (row+1) > (rows):
-                row = 0
-                col += 1
-            try:
-                self._file_grid.add( Label(fn, max_width=(self.width-12)//colums, font_color=COLOR_FILE_VIEWER_FONT), (col, row) ) 
-                #print('adding:', fn)
-            except IndexError as e:
-                print("rows:", rows, "col:", col, "row:", row, "cells:",len(self._file_grid))
-                raise e
-            row += 1
+        self._file_grid.set_data([".."] + self._files)
+        self._file_grid.selected_index = None
 
     @Region.x.setter
     def x(self, value):
-        self._x = value
-        self._controls.x=self._x
+        self._set_x(value)
+        self._controls.x=value
         
     @Region.y.setter
     def y(self, value):
-        self._y = value
-        self._controls.y=self._y        
+        self._set_y(value)
+        self._controls.y=value
 
-    def draw(self, surf):        
-        draw_panel(surf, self.x, self.y, self.width, self.height, self.color, darker(self.color, 0.3), brighter(self.color, 0.2))
+    def _draw_chrome(self, surf, x, y):
+        palette = self.palette
+        draw_panel(surf, x, y, self.width, self.height, self.color, palette.shade, palette.light)
         
-        draw_shaded_frame(surf, self.x+1, self.y+1, self.width-2, self._title_ctrl.height+8, darker(self.color, 0.3), brighter(self.color, 0.2), mode=1)
-        pygame.draw.rect(surf, darker(self._color, 0.4), (self.x+5, self.y+3, self.width-10, self._title_ctrl.height+7-2), border_radius=4)
+        draw_shaded_frame(surf, x+1, y+1, self.width-2, self._title_ctrl.height+8, palette.shade, palette.light, mode=1)
+        pygame.draw.rect(surf, palette.darker(0.4), (x+5, y+3, self.width-10, self._title_ctrl.height+7-2), border_radius=4)
 
-        file_viewer_rect = (self.x+3, self.y+45, self.width-5, self.height-(50+28+2+2))
+        file_viewer_rect = (x+3, y+45, self.width-5, self.height-(50+28+2+2))
         pygame.draw.rect(surf, COLOR_FILE_VIEWER, file_viewer_rect)
-        draw_shaded_frame(surf, *file_viewer_rect, darker(self.color, 0.2), brighter(self.color, 0.3), mode=1)
+        draw_shaded_frame(surf, *file_viewer_rect, palette.darker(0.2), palette.brighter(0.3), mode=1)
 
-        if self._selected_label is not None:
-            label_size = (self._selected_label.width+2, self._selected_label.height+2)
-            selection_rect = pygame.Surface(label_size).convert()
-            selection_rect.fill(COLOR_FILE_SELECTION)
-            surf.blit(selection_rect, (self._selected_label.x-1, self._selected_label.y-1), special_flags=pygame.BLEND_RGB_SUB )
+    def draw(self, surf):        
+        key = (FileDialog, self.width, self.height, tuple(self._color), self._title_ctrl.height, self._theme)
+        chrome = PANEL_CACHE.get(key, (self.width+1, self.height+1), lambda chrome: self._draw_chrome(chrome, 0, 0))
+        surf.blit(chrome, (self.x, self.y))
 
 class YesNoDialog(BaseControl):
     RESULT_YES, RESULT_NO, RESULT_IDK = range(1,4)
@@ -1700,6 +2654,7 @@ class YesNoDialog(BaseControl):
         self._text_margin = 50
         self._controls = Layout(self.x, self.y)
         self._controls._set_parent(self)
+        self._controls._set_owner(self)
         self._title_ctrl = self._controls.add(Label(self._title, shaded=True, max_width=self.width-10))
         self._title_ctrl.x = self.y + (self.width-self._title_ctrl.width)//2
         self._title_ctrl.y = self.y + 5        
@@ -1767,19 +2722,25 @@ class YesNoDialog(BaseControl):
         self._on_result_cb = types.MethodType(f_cb, self)
     on_result = property(fset=on_result)         
 
+    def _draw_chrome(self, surf, x, y):
+        palette = self.palette
+        draw_panel(surf, x, y, self.width, self.height, self.color, palette.shade, palette.light)
+        draw_shaded_frame(surf, x+1, y+1, self.width-2, self._title_ctrl.height+8, palette.shade, palette.light, mode=1)
+        pygame.draw.rect(surf, palette.darker(0.4), (x+5, y+3, self.width-10, self._title_ctrl.height+7-2), border_radius=4)        
+
     def draw(self, surf):        
-        draw_panel(surf, self.x, self.y, self.width, self.height, self.color, darker(self.color, 0.3), brighter(self.color, 0.2))
-        draw_shaded_frame(surf, self.x+1, self.y+1, self.width-2, self._title_ctrl.height+8, darker(self.color, 0.3), brighter(self.color, 0.2), mode=1)
-        pygame.draw.rect(surf, darker(self._color, 0.4), (self.x+5, self.y+3, self.width-10, self._title_ctrl.height+7-2), border_radius=4)        
+        key = (YesNoDialog, self.width, self.height, tuple(self._color), self._title_ctrl.height, self._theme)
+        chrome = PANEL_CACHE.get(key, (self.width+1, self.height+1), lambda chrome: self._draw_chrome(chrome, 0, 0))
+        surf.blit(chrome, (self.x, self.y))
 
     @Region.y.setter
     def y(self, value):
+        self._set_y(value)
         self._controls.y=value
-        self._y = value
     @Region.x.setter
     def x(self, value):
+        self._set_x(value)
         self._controls.x=value
-        self._x = value        
 
 class ToolPanel(BaseControl):
     def  __init__(self, spacing=0, margin=2, color=COLOR_FOREGROUND, mode=0, *args, **kwargs):
@@ -1789,6 +2750,7 @@ class ToolPanel(BaseControl):
         self._line = self._controls.add(VerticalLine(24, 6, mode=3))
         self._line.on_drag_move = self._drag_line
         super().__init__(0, 0, self._controls.spacing+self._margin, self._margin, color, **kwargs)            
+        self._controls._set_owner(self)
     
     def _drag_line(self, sender, mode, x, y, x_rel, y_rel, app, button):
         if mode==self.DRAG_MODE_BODY and button==pygame.BUTTON_LEFT:
@@ -1803,20 +2765,20 @@ class ToolPanel(BaseControl):
 
     @Region.y.getter
     def y(self):
-        return self._y
+        return self._abs_pos()[1]
 
     @y.setter
     def y(self, value):
-        self._y = value
+        self._set_y(value)
         self._controls.y = value + self._margin
 
     @Region.x.getter
     def x(self):
-        return self._x
+        return self._abs_pos()[0]
 
     @x.setter
     def x(self, value):
-        self._x = value
+        self._set_x(value)
         self._controls.x = value + self._margin
 
     @Region.height.getter
@@ -1827,8 +2789,8 @@ class ToolPanel(BaseControl):
     def width(self):
         return self._controls.width + self._margin * 2
     
-    def draw(self, surf):
-        draw_panel(surf, self._x, self._y, self.width, self.height, self._color )         
+    def render(self, surf, x, y):
+        draw_panel_cached(surf, x, y, self.width, self.height, self._color, theme=self._theme)         
 
 class StatusBar(BaseControl):
     def  __init__(self, height=24, margin=5, spacing=0, color=COLOR_FOREGROUND, mode=0, *args, **kwargs):        
@@ -1836,6 +2798,7 @@ class StatusBar(BaseControl):
         self._controls._set_parent( self )
         self._margin = margin
         super().__init__(0, 0, 8, height, color, **kwargs)
+        self._controls._set_owner(self)
         self._drop_shadow = False
         self._cell_spacing_left = self._cell_spacing_right = 4
         self._cell_spacing_top = self._cell_spacing_bottom = 2
@@ -1855,24 +2818,24 @@ class StatusBar(BaseControl):
     def y(self):
         if self.app is not None:
             new_y = self.app.screen_height - self.height
-            if new_y !=self._y:
-                self._y = new_y
+            if new_y !=self._abs_pos()[1]:
+                self._set_y(new_y)
                 self._controls.y = new_y + self._margin
                 self._controls._re_align()
-        return self._y
+        return self._abs_pos()[1]
 
     @y.setter
     def y(self, value):
-        self._y = value
+        self._set_y(value)
         self._controls.y = value
 
     @Region.x.getter
     def x(self):
-        return self._x
+        return self._abs_pos()[0]
 
     @x.setter
     def x(self, value):
-        self._x = value
+        self._set_x(value)
         self._controls.x = value
 
     @Region.height.getter
@@ -1889,14 +2852,20 @@ class StatusBar(BaseControl):
             return self.app.screen_width
         return self._width
 
-    def draw(self, surf):
-        draw_panel(surf, self.x, self.y, self.width, self.height, self._color)
+    def _retained_key(self):
+        return (self.width, self.height) + tuple((ctrl.x-self.x, ctrl.y-self.y, ctrl.width, ctrl.height) for ctrl in self._controls)
+
+    def render(self, surf, x, y):
+        draw_panel_cached(surf, x, y, self.width, self.height, self._color, theme=self._theme)
+        cell_color = self.palette.darker(0.1)
+        x_off = x - self.x
+        y_off = y - self.y
         line_sepa_width = 1
         for i, ctrl in enumerate(self._controls, start=1):
             
-            draw_panel(surf, ctrl.x-self._cell_spacing_left, ctrl.y-self._cell_spacing_top, 
+            draw_panel_cached(surf, ctrl.x-self._cell_spacing_left+x_off, ctrl.y-self._cell_spacing_top+y_off, 
                         ctrl.width+self._cell_spacing_left+self._cell_spacing_right, ctrl.height+self._cell_spacing_top+self._cell_spacing_bottom, 
-                        darker(self._color, 0.1), mode=1)
+                        cell_color, mode=1, theme=self._theme)
             # if i != 1:                
             #     draw_panel(surf, ctrl.x-self._cell_spacing_left-self._margin-line_sepa_width, ctrl.y-self._cell_spacing_top, 
             #                line_sepa_width, 
@@ -1909,13 +2878,9 @@ class HorizontalLine(BaseControl):
         self._thickness = thickness
         self._mode = mode
 
-        self.SHADED_COLOR = darker(self._color, SHADE_TINT)
-        self.LIGHTER_COLOR = brighter(self._color, LIGHT_TINT)            
-        self._shade_color = self.LIGHTER_COLOR        
-        self._light_color = self.SHADED_COLOR
-
-    def draw(self, surf):
-        draw_panel(surf, self.x, self.y, self.width, self.height, self._color,  self._shade_color, self._light_color, self._mode )
+    def render(self, surf, x, y):
+        palette = self.palette # light on top, shade below
+        draw_panel(surf, x, y, self.width, self.height, self._color,  palette.light, palette.shade, self._mode, theme=self._theme)
 
 class Label(BaseControl):
     """ Basically draws a text string at specified coordinates
@@ -2037,13 +3002,13 @@ class Label(BaseControl):
 
         if self._shaded:
             shaded_image = label_img.copy()
-            colorImage = pygame.Surface(shaded_image.get_size()).convert_alpha()
+            colorImage = SCRATCH_SURFACES.get(shaded_image.get_size(), pygame.SRCALPHA)
             colorImage.fill(darker(self._color, 0.7))
             shaded_image.blit(colorImage, (0,0), special_flags = pygame.BLEND_RGBA_MULT)
             self._shaded_image = pygame.transform.scale(shaded_image, (self.width, self.height) )
 
         # text coloring
-        colorImage = pygame.Surface(label_img.get_size()).convert_alpha()
+        colorImage = SCRATCH_SURFACES.get(label_img.get_size(), pygame.SRCALPHA)
         colorImage.fill(self._color)
         label_img.blit(colorImage, (0,0), special_flags = pygame.BLEND_RGBA_MULT)
 